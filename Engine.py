@@ -1,6 +1,37 @@
 # Engine stores all information about the current state of the game. 
 # Allows the main driver to interact with the current state of the game. 
 # Also determines valid moves. 
+import random
+from array import array
+from collections import OrderedDict
+
+import evaluation
+
+#Zobrist keys: one random 64-bit number per (piece, square), castling rights combination, en passant file
+#and side to move. A position's key is the xor of the numbers for everything in it, so a move only has to
+#xor out what changed. Fixed seed so keys are the same in every process.
+_zobrist_random = random.Random(20240601)
+ZOBRIST_PIECES = {color + kind: [_zobrist_random.getrandbits(64) for _ in range(64)]
+                  for color in 'wb' for kind in 'pNBRQK'}
+ZOBRIST_CASTLE = [_zobrist_random.getrandbits(64) for _ in range(16)]
+ZOBRIST_ENPASSANT = [_zobrist_random.getrandbits(64) for _ in range(8)]
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+
+#pieces a pawn can promote to, in the order promotions are generated
+PROMOTIONS = ('Q', 'R', 'B', 'N')
+#piece kinds from least to most valuable
+PIECE_ORDER = 'pNBRQK'
+
+#make_move saves the state a move can't be undone from (key, castling rights, en passant file, halfmove clock
+#and the running scores) in GameState.undo_stack, UNDO_FIELDS unsigned 64-bit slots per ply:
+#  key
+#  castling index | en passant file + 1 (0 = none) << 4 | halfmove clock << 8 | phase << 24 | material << 32
+#  middlegame score << 32 | endgame score
+#signed values are stored offset by the constants below
+UNDO_FIELDS = 3
+UNDO_PLIES = 256 #plies allocated at a time
+MATERIAL_OFFSET = 1 << 15
+SCORE_OFFSET = 1 << 31
 
 class GameState:
     def __init__(self): 
@@ -28,6 +59,10 @@ class GameState:
         self.in_check = False
         self.pins = []
         self.checks = []
+        self.attack_map = None #squares the side not to move attacks, see enemy_attacks()
+        self.prepared_pins = () #set by prepare_moves, with evasion_squares
+        self.evasion_squares = None
+        self.move_cache = None #optional MoveCache for get_valid_moves
 
         self.checkmate = False
         self.stalemate = False
@@ -37,13 +72,250 @@ class GameState:
         self.wQ_castle = True
         self.bK_castle = True
         self.bQ_castle = True
-        self.castle_log = [CastleRights(self.wK_castle, self.bK_castle, self.wQ_castle, self.bQ_castle)]
+        #position identity and draw bookkeeping
+        self.halfmove_clock = 0 #plies since the last capture or pawn move
+        self.undo_stack = array('Q', bytes(8 * UNDO_FIELDS * UNDO_PLIES)) #see UNDO_FIELDS
+        self.start_fullmove = 1 #fullmove number and side to move the game started from, for to_fen
+        self.start_white_to_move = True
+        self.reset_zobrist()
+        self.reset_scores()
+
+    #Pickled (and copied) without the move cache: a GameState sent to another process would otherwise carry
+    #every cached move list with it
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['move_cache'] = None
+        return state
+
+    #Recomputes the Zobrist key from scratch and restarts the repetition history at the current position
+    def reset_zobrist(self):
+        key = 0
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != '--':
+                    key ^= ZOBRIST_PIECES[piece][row * 8 + col]
+        key ^= ZOBRIST_CASTLE[self.castle_index()]
+        if self.enPassant:
+            key ^= ZOBRIST_ENPASSANT[self.enPassant[1]]
+        if not self.white_to_move:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        self.zobrist_key = key
+        self.position_counts = {key: 1} #occurrences of each key in the game so far
+
+    #Recomputes the running evaluation terms from the board: middlegame and endgame material + piece-square
+    #scores, game phase and plain material, all from white's point of view. make_move/undo_move keep them up
+    #to date from there so evaluation never has to scan the board.
+    def reset_scores(self):
+        self.mg_score, self.eg_score, self.phase, self.material = evaluation.score_board(self.board)
+
+    #Castling rights packed into 4 bits (white king side, white queen side, black king side, black queen side)
+    def castle_index(self):
+        return (self.wK_castle | (self.wQ_castle << 1) | (self.bK_castle << 2) | (self.bQ_castle << 3))
+
+    #True if the current position has occurred at least `times` times
+    def is_repetition(self, times=3):
+        return self.position_counts.get(self.zobrist_key, 0) >= times
+
+    #True once 50 moves by each side have passed without a capture or pawn move
+    def is_fifty_move_rule(self):
+        return self.halfmove_clock >= 100
+
+    #Builds a GameState from a FEN string: piece placement, side to move, castling rights, en passant square
+    #and the two move clocks (the last four fields are optional)
+    @classmethod
+    def from_fen(cls, fen):
+        fields = fen.split()
+        if len(fields) < 2 or len(fields[0].split('/')) != 8:
+            raise ValueError("invalid FEN: %s" % fen)
+        gs = cls()
+        for row, rank in enumerate(fields[0].split('/')):
+            col = 0
+            for char in rank:
+                if char.isdigit():
+                    if char == '0' or col + int(char) > 8:
+                        raise ValueError("invalid FEN: %s" % fen)
+                    for _ in range(int(char)):
+                        gs.board[row][col] = '--'
+                        col += 1
+                elif char.lower() in 'pnbrqk' and col < 8:
+                    piece = ('w' if char.isupper() else 'b') + (char.upper() if char.lower() != 'p' else 'p')
+                    gs.board[row][col] = piece
+                    if piece == 'wK':
+                        gs.wK_location = (row, col)
+                    elif piece == 'bK':
+                        gs.bK_location = (row, col)
+                    col += 1
+                else:
+                    raise ValueError("invalid FEN: %s" % fen)
+            if col != 8:
+                raise ValueError("invalid FEN: %s" % fen)
+        pieces = [piece for row in gs.board for piece in row]
+        if pieces.count('wK') != 1 or pieces.count('bK') != 1:
+            raise ValueError("invalid FEN, each side needs exactly one king: %s" % fen)
+        if any(piece[1] == 'p' for piece in gs.board[0] + gs.board[7]):
+            raise ValueError("invalid FEN, pawn on the first or last rank: %s" % fen)
+        if fields[1] not in ('w', 'b'):
+            raise ValueError("invalid FEN, side to move must be w or b: %s" % fen)
+        gs.white_to_move = fields[1] == 'w'
+        #the side that just moved can't have left its king attacked, or the king itself could be taken
+        row, col = gs.bK_location if gs.white_to_move else gs.wK_location
+        if gs.square_under_attack(row, col, 'b' if gs.white_to_move else 'w'):
+            raise ValueError("invalid FEN, the side not to move is in check: %s" % fen)
+        rights = fields[2] if len(fields) > 2 else '-'
+        #a right whose king or rook isn't on its home square is dropped rather than trusted
+        board = gs.board
+        gs.wK_castle = 'K' in rights and board[7][4] == 'wK' and board[7][7] == 'wR'
+        gs.wQ_castle = 'Q' in rights and board[7][4] == 'wK' and board[7][0] == 'wR'
+        gs.bK_castle = 'k' in rights and board[0][4] == 'bK' and board[0][7] == 'bR'
+        gs.bQ_castle = 'q' in rights and board[0][4] == 'bK' and board[0][0] == 'bR'
+        gs.enPassant = ()
+        if len(fields) > 3 and fields[3] != '-':
+            #undo_move keeps only the file, the rank follows from the side to move
+            if len(fields[3]) != 2 or fields[3][0] not in Move.files_to_cols or fields[3][1] != (
+                    '6' if gs.white_to_move else '3'):
+                raise ValueError("invalid FEN: %s" % fen)
+            gs.enPassant = (Move.rank_to_rows[fields[3][1]], Move.files_to_cols[fields[3][0]])
+        gs.halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+        if not 0 <= gs.halfmove_clock <= 0xFFFF:
+            raise ValueError("invalid FEN: %s" % fen)
+        gs.start_fullmove = int(fields[5]) if len(fields) > 5 else 1
+        gs.start_white_to_move = gs.white_to_move
+        gs.reset_zobrist()
+        gs.reset_scores()
+        return gs
+
+    #FEN string of the current position
+    def to_fen(self):
+        ranks = []
+        for row in self.board:
+            rank = ''
+            empty = 0
+            for piece in row:
+                if piece == '--':
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += piece[1].upper() if piece[0] == 'w' else piece[1].lower()
+            ranks.append(rank + (str(empty) if empty else ''))
+        rights = (('K' if self.wK_castle else '') + ('Q' if self.wQ_castle else '')
+                  + ('k' if self.bK_castle else '') + ('q' if self.bQ_castle else '')) or '-'
+        en_passant = Move.cols_to_files[self.enPassant[1]] + Move.rows_to_ranks[self.enPassant[0]] if self.enPassant else '-'
+        fullmove = self.start_fullmove + (len(self.move_log) + (0 if self.start_white_to_move else 1)) // 2
+        return "%s %s %s %s %d %d" % ('/'.join(ranks), 'w' if self.white_to_move else 'b', rights, en_passant,
+                                      self.halfmove_clock, fullmove)
+
+    #Standard algebraic notation (Nf3, exd5, O-O, e8=Q+) for a legal move in the current position
+    def get_san(self, move):
+        if move.castle:
+            san = 'O-O' if move.end_col > move.start_col else 'O-O-O'
+        else:
+            kind = move.piece_moved[1]
+            target = move.get_rank_file(move.end_row, move.end_col)
+            capture = 'x' if move.captured != '--' else ''
+            if kind == 'p':
+                san = (move.cols_to_files[move.start_col] + capture if capture else '') + target
+                if move.pawn_promo:
+                    san += '=' + (move.promo_piece or 'Q')
+            else:
+                #another piece of the same kind that can reach the same square needs the file, rank or both
+                others = [m for m in self.get_valid_moves() if m.piece_moved == move.piece_moved
+                          and (m.end_row, m.end_col) == (move.end_row, move.end_col)
+                          and (m.start_row, m.start_col) != (move.start_row, move.start_col)]
+                prefix = ''
+                if others:
+                    if all(m.start_col != move.start_col for m in others):
+                        prefix = move.cols_to_files[move.start_col]
+                    elif all(m.start_row != move.start_row for m in others):
+                        prefix = move.rows_to_ranks[move.start_row]
+                    else:
+                        prefix = move.get_rank_file(move.start_row, move.start_col)
+                san = kind + prefix + capture + target
+        state = (self.in_check, self.checkmate, self.stalemate)
+        self.make_move(move)
+        has_reply = self.has_legal_move()
+        if self.in_check:
+            san += '#' if not has_reply else '+'
+        self.undo_move()
+        self.in_check, self.checkmate, self.stalemate = state
+        return san
+
+    #The legal Move a SAN string describes. Raises ValueError if it is illegal or ambiguous.
+    def parse_san(self, san):
+        text = san.strip().rstrip('+#!?')
+        moves = self.get_valid_moves()
+        if text in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+            king_side = len(text) == 3
+            for move in moves:
+                if move.castle and (move.end_col > move.start_col) == king_side:
+                    return move
+            raise ValueError("illegal move: %s" % san)
+        promoted = None
+        if '=' in text:
+            text, promoted = text.split('=', 1)
+        elif len(text) > 2 and text[-1] in 'QRBN' and text[-2].isdigit():
+            text, promoted = text[:-1], text[-1]
+        kind = text[0] if text[:1] in ('K', 'Q', 'R', 'B', 'N') else 'p'
+        body = (text[1:] if kind != 'p' else text).replace('x', '').replace('-', '')
+        if len(body) < 2 or body[-2] not in Move.files_to_cols or body[-1] not in Move.rank_to_rows:
+            raise ValueError("invalid move: %s" % san)
+        end = (Move.rank_to_rows[body[-1]], Move.files_to_cols[body[-2]])
+        hint = body[:-2]
+        candidates = []
+        for move in moves:
+            if move.piece_moved[1] != kind or (move.end_row, move.end_col) != end:
+                continue
+            if any((char in Move.files_to_cols and Move.files_to_cols[char] != move.start_col)
+                   or (char in Move.rank_to_rows and Move.rank_to_rows[char] != move.start_row) for char in hint):
+                continue
+            if move.pawn_promo != (promoted is not None):
+                continue
+            if promoted and move.promo_piece not in (None, promoted[:1]):
+                continue
+            candidates.append(move)
+        if len(candidates) != 1:
+            raise ValueError("%s move: %s" % ("ambiguous" if candidates else "illegal", san))
+        return candidates[0]
 
     #Takes a Move object and executes it (no castling, pawn promo, or en-passant)
     def make_move(self, move):
+        #save what undo_move can't work out from the move, see UNDO_FIELDS
+        stack = self.undo_stack
+        slot = len(self.move_log) * UNDO_FIELDS
+        if slot == len(stack):
+            stack.frombytes(bytes(8 * UNDO_FIELDS * UNDO_PLIES))
+        stack[slot] = self.zobrist_key
+        stack[slot + 1] = (self.castle_index() | ((self.enPassant[1] + 1) << 4 if self.enPassant else 0)
+                           | self.halfmove_clock << 8 | self.phase << 24 | (self.material + MATERIAL_OFFSET) << 32)
+        stack[slot + 2] = (self.mg_score + SCORE_OFFSET) << 32 | (self.eg_score + SCORE_OFFSET)
+
+        pieces = ZOBRIST_PIECES
+        start = move.start_row * 8 + move.start_col
+        end = move.end_row * 8 + move.end_col
+        #xor out the moving piece, whatever it captures and the old castling/en passant state
+        key = (self.zobrist_key ^ ZOBRIST_BLACK_TO_MOVE ^ pieces[move.piece_moved][start]
+               ^ ZOBRIST_CASTLE[self.castle_index()])
+        #evaluation terms change the same way: take out the moving piece and whatever it captures
+        mg_scores, eg_scores = evaluation.MG_SCORES, evaluation.EG_SCORES
+        mg = self.mg_score - mg_scores[move.piece_moved][start]
+        eg = self.eg_score - eg_scores[move.piece_moved][start]
+        phase, material = self.phase, self.material
+        if move.captured != '--':
+            captured_sq = move.start_row * 8 + move.end_col if move.enPassant else end
+            key ^= pieces[move.captured][captured_sq]
+            mg -= mg_scores[move.captured][captured_sq]
+            eg -= eg_scores[move.captured][captured_sq]
+            phase -= evaluation.PHASE[move.captured]
+            material -= evaluation.MATERIAL[move.captured]
+        if self.enPassant:
+            key ^= ZOBRIST_ENPASSANT[self.enPassant[1]]
+
         self.board[move.start_row][move.start_col] = "--"
         self.board[move.end_row][move.end_col] = move.piece_moved
         self.move_log.append(move) #allows undo function
+        self.attack_map = None
         self.white_to_move = not self.white_to_move #flips to other players move
         if move.piece_moved == "wK":
             self.wK_location = (move.end_row, move.end_col)
@@ -55,36 +327,78 @@ class GameState:
             self.enPassant = ((move.end_row + move.start_row) // 2, move.end_col)
         else:
             self.enPassant = ()
-        
+
         #if enPassant move. must update board to capture pawn
         if move.enPassant:
             self.board[move.start_row][move.end_col] = '--'
         #if pawn promo change piece
         if move.pawn_promo:
-            promoted = input("Promote to Q, R, B, or N:") #added to ui
+            promoted = move.promo_piece or 'Q' #a hand-built Move without a piece promotes to a queen
             self.board[move.end_row][move.end_col] = move.piece_moved[0] + promoted
+            phase += evaluation.PHASE[move.piece_moved[0] + promoted]
+            material += evaluation.MATERIAL[move.piece_moved[0] + promoted] - evaluation.MATERIAL[move.piece_moved]
 
         #update castling
         self.update_castle(move)
-        self.castle_log.append(CastleRights(self.wK_castle, self.bK_castle, self.wQ_castle, self.bQ_castle))
 
         if move.castle:
+            rook = move.piece_moved[0] + 'R'
             if move.end_col - move.start_col == 2:
                 self.board[move.end_row][move.end_col - 1] = self.board[move.end_row][move.end_col + 1]
                 self.board[move.end_row][move.end_col + 1] = '--'
+                rook_from, rook_to = end + 1, end - 1
             else: #queen side
                 self.board[move.end_row][move.end_col + 1] = self.board[move.end_row][move.end_col - 2]
                 self.board[move.end_row][move.end_col - 2] = '--'
+                rook_from, rook_to = end - 2, end + 1
+            key ^= pieces[rook][rook_from] ^ pieces[rook][rook_to]
+            mg += mg_scores[rook][rook_to] - mg_scores[rook][rook_from]
+            eg += eg_scores[rook][rook_to] - eg_scores[rook][rook_from]
+
+        #add the piece that ended up on the target square (the promoted piece on promotion) and the new state
+        landed = self.board[move.end_row][move.end_col]
+        self.mg_score = mg + mg_scores[landed][end]
+        self.eg_score = eg + eg_scores[landed][end]
+        self.phase = phase
+        self.material = material
+        key ^= pieces[landed][end] ^ ZOBRIST_CASTLE[self.castle_index()]
+        if self.enPassant:
+            key ^= ZOBRIST_ENPASSANT[self.enPassant[1]]
+        self.zobrist_key = key
+        self.position_counts[key] = self.position_counts.get(key, 0) + 1
+        if move.piece_moved[1] == 'p' or move.captured != '--':
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
 
-
- 
     #Undos the last move
     def undo_move(self):
         if len(self.move_log) != 0: 
             move = self.move_log.pop()
+            self.attack_map = None
+            count = self.position_counts[self.zobrist_key] - 1
+            if count:
+                self.position_counts[self.zobrist_key] = count
+            else:
+                del self.position_counts[self.zobrist_key]
+            #everything make_move couldn't derive from the move comes back from the undo stack
+            slot = len(self.move_log) * UNDO_FIELDS
+            stack = self.undo_stack
+            self.zobrist_key = stack[slot]
+            state, scores = stack[slot + 1], stack[slot + 2]
+            self.wK_castle, self.wQ_castle = bool(state & 1), bool(state & 2)
+            self.bK_castle, self.bQ_castle = bool(state & 4), bool(state & 8)
+            ep_file = (state >> 4) & 15
+            self.halfmove_clock = (state >> 8) & 0xFFFF
+            self.phase = (state >> 24) & 0xFF
+            self.material = ((state >> 32) & 0xFFFF) - MATERIAL_OFFSET
+            self.mg_score = (scores >> 32) - SCORE_OFFSET
+            self.eg_score = (scores & 0xFFFFFFFF) - SCORE_OFFSET
             self.board[move.start_row][move.start_col] = move.piece_moved
             self.board[move.end_row][move.end_col] = move.captured
             self.white_to_move = not self.white_to_move #switches turn back
+            #rank 6 (behind a black pawn) with white to move, rank 3 with black to move
+            self.enPassant = ((2 if self.white_to_move else 5), ep_file - 1) if ep_file else ()
             if move.piece_moved == "wK":
                 self.wK_location = (move.start_row, move.start_col)
             elif move.piece_moved == "bK":
@@ -93,52 +407,39 @@ class GameState:
             if move.enPassant:
                 self.board[move.end_row][move.end_col] = '--'
                 self.board[move.start_row][move.end_col] = move.captured
-                self.enPassant = (move.end_row, move.end_col)
-            
-            if move.piece_moved[1] == 'p' and abs(move.start_row - move.end_row) == 2:
-                self.enPassant = ()
 
-            self.castle_log.pop()
-            castle_rights = self.castle_log[-1]
-            self.wK_castle = castle_rights.wks
-            self.bK_castle = castle_rights.bks
-            self.wQ_castle = castle_rights.wqs
-            self.bQ_castle = castle_rights.bqs
+            if move.castle: #put the rook back
+                if move.end_col - move.start_col == 2:
+                    self.board[move.end_row][move.end_col + 1] = self.board[move.end_row][move.end_col - 1]
+                    self.board[move.end_row][move.end_col - 1] = '--'
+                else:
+                    self.board[move.end_row][move.end_col - 2] = self.board[move.end_row][move.end_col + 1]
+                    self.board[move.end_row][move.end_col + 1] = '--'
 
     #All moves considering checks
     def get_valid_moves(self):
-        moves = []
-        self.in_check, self.pins, self.checks = self.check_pins_and_checks()
+        cache = self.move_cache
+        if cache is not None:
+            entry = cache.get(self.zobrist_key)
+            if entry is not None: #restore what prepare_moves would have set, the moves are a fresh list
+                moves, self.in_check, self.prepared_pins, self.checks, self.evasion_squares = entry
+                self.pins = list(self.prepared_pins)
+                self.attack_map = None
+                self.checkmate = self.in_check and not moves
+                self.stalemate = not self.in_check and not moves
+                return list(moves)
+        self.prepare_moves()
         if self.white_to_move:
             king_row, king_col = self.wK_location[0], self.wK_location[1]
         else:
             king_row, king_col = self.bK_location[0], self.bK_location[1]
-        
-        if self.in_check:
-            if len(self.checks) == 1: #only 1 possible check, block check or move king!
-                moves = self.get_all_possible() #all possible moves
-                check = self.checks[0] #check info
-                check_row, check_col = check[0], check[1]
-                piece_checking = self.board[check_row][check_col]
-                valid_squares = []
-                if piece_checking[1] == 'N':
-                    valid_squares = [(check_row, check_col)]
-                else:
-                    for i in range(1, 8):
-                        sqr = (king_row + check[2]*i, king_col + check[3]*i) 
-                        valid_squares.append(sqr)
-                        if sqr[0] == check_row and valid_squares[1] == check_col:
-                            break
-                #reverse traversal and get rid of any moves that don't block check or move king
-                for i in range(len(moves)-1, -1, -1): 
-                    if moves[i].piece_moved[1] != "K": #does not move king
-                        if (moves[i].end_row, moves[i].end_col) not in valid_squares:
-                            moves.remove(moves[i])
-            else: #double check
-                self.get_king_moves(king_row, king_col, moves)
-        else: #not in check so all moves are valid
-            moves = self.get_all_possible()                 
-        
+
+        if self.in_check and len(self.checks) > 1: #double check, only the king can move
+            moves = []
+            self.get_king_moves(king_row, king_col, moves)
+        else:
+            moves = self.filter_evasions(self.get_all_possible())
+
         if len(moves) == 0:
             if self.in_check:
                 self.checkmate = True
@@ -148,8 +449,73 @@ class GameState:
             self.checkmate = False
             self.stalemate = False
 
+        if cache is not None:
+            cache.put(self.zobrist_key, (tuple(moves), self.in_check, self.prepared_pins, self.checks,
+                                         self.evasion_squares))
         return moves
 
+    #Checks, pins and, when in check, the squares a non-king move has to land on. Computed once per position
+    #so moves can then be generated all at once or a piece at a time with get_piece_moves.
+    def prepare_moves(self):
+        self.in_check, self.pins, self.checks = self.check_pins_and_checks()
+        self.prepared_pins = tuple(self.pins) #piece move functions use up self.pins, this is the full set
+        self.attack_map = None #built on first use by king move generation
+        self.evasion_squares = None
+        if self.in_check and len(self.checks) == 1: #only 1 possible check, block check or move king!
+            if self.white_to_move:
+                king_row, king_col = self.wK_location[0], self.wK_location[1]
+            else:
+                king_row, king_col = self.bK_location[0], self.bK_location[1]
+            check = self.checks[0] #check info
+            check_row, check_col = check[0], check[1]
+            piece_checking = self.board[check_row][check_col]
+            valid_squares = []
+            if piece_checking[1] == 'N':
+                valid_squares = [(check_row, check_col)]
+            else:
+                for i in range(1, 8):
+                    sqr = (king_row + check[2]*i, king_col + check[3]*i) 
+                    valid_squares.append(sqr)
+                    if sqr[0] == check_row and sqr[1] == check_col:
+                        break
+            self.evasion_squares = set(valid_squares)
+
+    #Keeps only king moves and moves that block the check or capture the checker, in one pass (removing from
+    #the list one at a time is O(n) each and matches by move_ID, not identity). No-op when not in check.
+    def filter_evasions(self, moves):
+        if self.evasion_squares is None:
+            return moves
+        valid_squares = self.evasion_squares
+        checker = (self.checks[0][0], self.checks[0][1])
+        return [move for move in moves if move.piece_moved[1] == "K"
+                or (move.end_row, move.end_col) in valid_squares
+                or (move.enPassant and (move.start_row, move.end_col) == checker)]
+
+    #Legal moves of the piece on (r, c) only. Needs prepare_moves (or get_valid_moves) for this position first.
+    def get_piece_moves(self, r, c):
+        moves = []
+        piece = self.board[r][c]
+        if piece[0] != ('w' if self.white_to_move else 'b'):
+            return moves
+        if self.in_check and len(self.checks) > 1 and piece[1] != 'K':
+            return moves
+        self.pins = list(self.prepared_pins)
+        self.move_funcs[piece[1]](r, c, moves)
+        return self.filter_evasions(moves)
+
+    #True if the side to move has any legal move. Stops at the first piece that has one, so mate and
+    #stalemate checks don't need the whole move list. The king goes last as its moves need the attack map.
+    def has_legal_move(self):
+        self.prepare_moves()
+        king = self.wK_location if self.white_to_move else self.bK_location
+        if not (self.in_check and len(self.checks) > 1):
+            ally = 'w' if self.white_to_move else 'b'
+            for row in range(8):
+                for col in range(8):
+                    if self.board[row][col][0] == ally and (row, col) != king and self.get_piece_moves(row, col):
+                        return True
+        return len(self.get_piece_moves(king[0], king[1])) > 0
+
     def check_pins_and_checks(self):
         pins = []
         checks = []
@@ -239,34 +605,63 @@ class GameState:
             move_amt, start_row, back_row, enemy = -1, 6, 0, 'b'
         else:
             move_amt, start_row, back_row, enemy = 1, 1, 7, 'w'
-        promo = False
+        promo = r + move_amt == back_row
 
         if self.board[r + move_amt][c] == '--':
             if not is_pinned or pin_direction == (move_amt, 0):
-                if r + move_amt == back_row:
-                    promo = True
-                moves.append(Move((r, c), (r + move_amt, c), self.board, pawn_promo=promo))
+                self.add_pawn_move((r, c), (r + move_amt, c), promo, moves)
                 if r == start_row and self.board[r + 2*move_amt][c] == '--':
                     moves.append(Move((r, c), (r + 2*move_amt, c), self.board))
 
         if c - 1 >= 0: #capture to left
             if not is_pinned or pin_direction == (move_amt, -1):
                 if self.board[r + move_amt][c - 1][0] == enemy:
-                    if r + move_amt == back_row:
-                        promo = True
-                    moves.append(Move((r, c), (r + move_amt, c - 1), self.board, pawn_promo=promo))
-                if (r + move_amt, c - 1) == self.enPassant:
+                    self.add_pawn_move((r, c), (r + move_amt, c - 1), promo, moves)
+                if (r + move_amt, c - 1) == self.enPassant and not self.enpassant_exposes_king(r, c, c - 1):
                     moves.append(Move((r, c), (r + move_amt, c - 1), self.board, enPassant=True))
         if c + 1 <= 7: #capture to right
             if not is_pinned or pin_direction == (move_amt, 1):
                 if self.board[r + move_amt][c + 1][0] == enemy:
-                    if r + move_amt == back_row:
-                        promo = True
-                    moves.append(Move((r, c), (r + move_amt, c + 1), self.board, pawn_promo=promo))
-                if (r + move_amt, c + 1) == self.enPassant:
+                    self.add_pawn_move((r, c), (r + move_amt, c + 1), promo, moves)
+                if (r + move_amt, c + 1) == self.enPassant and not self.enpassant_exposes_king(r, c, c + 1):
                     moves.append(Move((r, c), (r + move_amt, c + 1), self.board, enPassant=True))            
 
-        
+
+    #A pawn move onto the back rank is four moves, one per promotion piece, so the piece is part of the move
+    #and making it never has to ask anyone
+    def add_pawn_move(self, start, end, promo, moves):
+        if promo:
+            for piece in PROMOTIONS:
+                moves.append(Move(start, end, self.board, pawn_promo=True, promo_piece=piece))
+        else:
+            moves.append(Move(start, end, self.board))
+
+    #En passant takes two pawns off the same row at once, which the pin scan can't see.
+    #True if that would open the row between our king and an enemy rook or queen.
+    def enpassant_exposes_king(self, r, c, capture_col):
+        if self.white_to_move:
+            king_row, king_col, enemy = self.wK_location[0], self.wK_location[1], 'b'
+        else:
+            king_row, king_col, enemy = self.bK_location[0], self.bK_location[1], 'w'
+        if king_row != r:
+            return False
+        if king_col < c:
+            inside = range(king_col + 1, min(c, capture_col))
+            outside = range(max(c, capture_col) + 1, 8)
+        else:
+            inside = range(king_col - 1, max(c, capture_col), -1)
+            outside = range(min(c, capture_col) - 1, -1, -1)
+        for col in inside:
+            if self.board[r][col] != '--':
+                return False
+        for col in outside:
+            end_piece = self.board[r][col]
+            if end_piece[0] == enemy and end_piece[1] in ('R', 'Q'):
+                return True
+            elif end_piece != '--':
+                return False
+        return False
+
     #Get all the rook moves for the rook at location (r,c) and adds to the list of valid moves
     def get_rook_moves(self, r, c, moves): 
         is_pinned = False
@@ -364,24 +759,12 @@ class GameState:
             end_col = c + col_moves[i]
             if 0 <= end_row < 8 and 0 <= end_col < 8:
                 end_piece = self.board[end_row][end_col]
-                if end_piece[0] != ally:
-                    if ally == 'w':
-                        self.wK_location = (end_row, end_col)
-                    else:
-                        self.bK_location = (end_row, end_col)
-                    in_check, pins, checks = self.check_pins_and_checks()
-                    if not in_check:
-                        moves.append(Move((r, c), (end_row, end_col), self.board))
-                    
-                    if ally == 'w':
-                        self.wK_location = (r, c)
-                    else:
-                        self.bK_location = (r, c)
+                if end_piece[0] != ally and (end_row, end_col) not in self.enemy_attacks():
+                    moves.append(Move((r, c), (end_row, end_col), self.board))
         self.get_castle_moves(r, c, moves, ally)
     
     def get_castle_moves(self, r, c, moves, ally):
-        in_check = self.square_under_attack(r, c, ally)
-        if in_check:
+        if self.in_check:
             return
         
         if (self.white_to_move and self.wK_castle) or (not self.white_to_move and self.bK_castle):
@@ -390,14 +773,77 @@ class GameState:
             self.get_queen_castlemoves(r, c, moves, ally)
 
     def get_king_castlemoves(self, r, c, moves, ally):
-        if self.board[r][c + 1] == '--' and self.board[r][c + 2] == '--' and not self.square_under_attack(r, c + 1, ally) and not self.square_under_attack(r, c + 2, ally):
-            moves.append(Move((r, c), (r, c + 2), self.board, castle=True))
+        if self.board[r][c + 1] == '--' and self.board[r][c + 2] == '--':
+            attacked = self.enemy_attacks()
+            if (r, c + 1) not in attacked and (r, c + 2) not in attacked:
+                moves.append(Move((r, c), (r, c + 2), self.board, castle=True))
     
     def get_queen_castlemoves(self, r, c, moves, ally):
-        if self.board[r][c - 1] == '--' and self.board[r][c - 2] == '--' and self.board[r][c - 3] == '--' and not self.square_under_attack(r, c - 1, ally) and not self.square_under_attack(r, c - 2, ally):
-            moves.append(Move((r, c), (r, c - 2), self.board, castle=True))
+        if self.board[r][c - 1] == '--' and self.board[r][c - 2] == '--' and self.board[r][c - 3] == '--':
+            attacked = self.enemy_attacks()
+            if (r, c - 1) not in attacked and (r, c - 2) not in attacked:
+                moves.append(Move((r, c), (r, c - 2), self.board, castle=True))
+
+    #Attack map of the side not to move for the current position, built once per get_valid_moves and only
+    #if the king actually has a square to go to
+    def enemy_attacks(self):
+        if self.attack_map is None:
+            self.attack_map = self.get_attack_map('b' if self.white_to_move else 'w')
+        return self.attack_map
+
+    #Every square the enemy attacks, built in one pass over the board so king moves and castling are set
+    #lookups instead of a ray scan per square. The side to move's king is treated as empty, so squares behind
+    #it on a checking line count as attacked and the king can't retreat along the ray.
+    def get_attack_map(self, enemy):
+        attacked = set()
+        board = self.board
+        own_king = 'bK' if enemy == 'w' else 'wK'
+        pawn_row = -1 if enemy == 'w' else 1 #direction enemy pawns capture in
+        straight = ((-1, 0), (0, -1), (1, 0), (0, 1))
+        diagonal = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+        knight_directions = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+        slider_directions = {'R': straight, 'B': diagonal, 'Q': straight + diagonal}
+        for row in range(8):
+            for col in range(8):
+                piece = board[row][col]
+                if piece[0] != enemy:
+                    continue
+                kind = piece[1]
+                if kind == 'p':
+                    if col > 0:
+                        attacked.add((row + pawn_row, col - 1))
+                    if col < 7:
+                        attacked.add((row + pawn_row, col + 1))
+                elif kind == 'N' or kind == 'K':
+                    for m in (knight_directions if kind == 'N' else slider_directions['Q']):
+                        end_row, end_col = row + m[0], col + m[1]
+                        if 0 <= end_row < 8 and 0 <= end_col < 8:
+                            attacked.add((end_row, end_col))
+                else:
+                    for d in slider_directions[kind]:
+                        end_row, end_col = row + d[0], col + d[1]
+                        while 0 <= end_row < 8 and 0 <= end_col < 8:
+                            attacked.add((end_row, end_col))
+                            end_piece = board[end_row][end_col]
+                            if end_piece != '--' and end_piece != own_king: #blocked
+                                break
+                            end_row += d[0]
+                            end_col += d[1]
+        return attacked
 
     def square_under_attack(self, r, c, ally):
+        for _ in self.attackers(r, c, ally):
+            return True
+        return False
+
+    #Enemy pieces (of the side that isn't ally) attacking (r, c) as (row, col, piece), least valuable first,
+    #for static exchange evaluation. Only the first piece along each ray counts; pieces behind it join in once
+    #it has been taken off the board.
+    def get_attackers(self, r, c, ally):
+        return sorted(self.attackers(r, c, ally), key=lambda attacker: PIECE_ORDER.index(attacker[2][1]))
+
+    #Yields each enemy piece attacking (r, c): along the 8 rays (stopping at the first piece) and knight jumps
+    def attackers(self, r, c, ally):
         enemy = 'w' if ally == 'b' else 'b'
         directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
         for j in range(len(directions)):
@@ -416,9 +862,8 @@ class GameState:
                                 (i == 1 and type == 'p' and
                                  ((enemy == 'w' and 6 <= j <= 7) or (enemy == 'b' and 4 <= j <= 5))) or \
                                     (type == 'Q') or (i == 1 and type == 'K'):
-                            return True
-                        else:
-                            break
+                            yield (end_row, end_col, end_piece)
+                        break
                 else:
                     break
         knight_directions = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
@@ -428,11 +873,22 @@ class GameState:
             if 0 <= end_row < 8 and 0 <= end_col < 8:
                 end_piece = self.board[end_row][end_col]
                 if end_piece[0] == enemy and end_piece[1] == 'N':
-                    return True
-        return False
+                    yield (end_row, end_col, end_piece)
 
 
     def update_castle(self, move):
+        #a captured rook takes its side's castling right with it
+        if move.captured == 'wR' and move.end_row == 7:
+            if move.end_col == 7:
+                self.wK_castle = False
+            elif move.end_col == 0:
+                self.wQ_castle = False
+        elif move.captured == 'bR' and move.end_row == 0:
+            if move.end_col == 7:
+                self.bK_castle = False
+            elif move.end_col == 0:
+                self.bQ_castle = False
+
         if move.piece_moved == 'wK':
             self.wK_castle = False
             self.wQ_castle = False
@@ -452,12 +908,41 @@ class GameState:
                 elif move.start_col == 0:
                     self.bQ_castle = False
 
-class CastleRights():
-    def __init__(self, wks, bks, wqs, bqs):
-        self.wks = wks
-        self.bks = bks
-        self.wqs = wqs
-        self.bqs = bqs
+class MoveCache():
+    #Least recently used cache of legal move lists by Zobrist key, for front ends that keep coming back to the
+    #same positions (undo/redo, transpositions, repeated queries). The key covers the pieces, side to move,
+    #castling rights and en passant file, so everything that decides legality is part of it. Enable with
+    #gs.move_cache = MoveCache(size); a board changed by hand needs reset_zobrist() before the next lookup.
+    def __init__(self, size=4096):
+        self.size = max(1, size)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self.entries), 'capacity': self.size, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'hit_rate': self.hits / lookups if lookups else 0.0}
 
 
 class Move():
@@ -468,7 +953,12 @@ class Move():
     files_to_cols = {"a": 0, "b": 1, "c": 2, "d": 3, "e": 4, "f": 5, "g": 6, "h": 7}
     cols_to_files = {v: k for k, v in files_to_cols.items()}
 
-    def __init__(self, start_sq, end_sq, board, enPassant=False, pawn_promo=False, castle=False):
+    #Fixed attribute slots instead of a per-instance __dict__: moves are the most allocated objects in a
+    #search, and slots make each one much smaller and faster to build
+    __slots__ = ('start_row', 'start_col', 'end_row', 'end_col', 'piece_moved', 'captured', 'enPassant',
+                 'pawn_promo', 'castle', 'promo_piece', 'move_ID')
+
+    def __init__(self, start_sq, end_sq, board, enPassant=False, pawn_promo=False, castle=False, promo_piece=None):
         self.start_row, self.start_col = start_sq[0], start_sq[1]
         self.end_row, self.end_col = end_sq[0], end_sq[1]
         self.piece_moved = board[self.start_row][self.start_col]
@@ -476,6 +966,7 @@ class Move():
         self.enPassant = enPassant
         self.pawn_promo = pawn_promo
         self.castle = castle
+        self.promo_piece = promo_piece #'Q', 'R', 'B' or 'N' on promotions (a queen if left out)
         if enPassant:
             self.captured = 'bp' if self.piece_moved == 'wp' else 'wp'
         self.move_ID = (self.start_row * 1000 + self.start_col * 100
@@ -483,12 +974,16 @@ class Move():
         
     
 
-    #Overriding the equals method
+    #Overriding the equals method; the promotions of one pawn share a move_ID, the piece tells them apart
     def __eq__(self, other):
         if isinstance(other, Move):
-            return self.move_ID == other.move_ID
+            return self.move_ID == other.move_ID and self.promo_piece == other.promo_piece
         return False
 
+    #Equal moves hash equal, so moves can be used in sets and as dict keys
+    def __hash__(self):
+        return hash((self.move_ID, self.promo_piece))
+
 
     def get_chess_notation(self):
         return (self.get_rank_file(self.start_row, self.start_col) + " -> "
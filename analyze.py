@@ -0,0 +1,201 @@
+# PGN database analyzer.
+# Streams a PGN file game by game (it is never loaded whole), replays every game with GameState on a process
+# pool, a chunk of games per task, and writes one row per game to CSV or JSON lines, in file order, as soon as
+# its chunk is done. Memory stays bounded by the number of chunks in flight.
+# Per game: the tags, plies, result and how the game ended, captures, checks, castles and promotions per
+# side, the final FEN and, with --depth, shallow search scores every --every plies (white's point of view) with
+# the largest swing between two of them that aren't mate scores. A game with an illegal or unreadable move keeps
+# the stats up to it and gets an error column.
+# Usage:
+#   python analyze.py games.pgn --out stats.csv --workers 8
+#   python analyze.py games.pgn --out stats.jsonl --depth 2 --every 10
+import argparse
+import collections
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import Engine
+import pgn
+import search
+import selfplay
+
+CSV_FIELDS = ('number', 'event', 'white', 'black', 'date', 'result', 'termination', 'plies',
+              'white_captures', 'black_captures', 'white_checks', 'black_checks', 'white_castled', 'black_castled',
+              'promotions', 'final_fen', 'evals', 'max_swing', 'error', 'seconds')
+
+_searcher = None #one per worker process, so the hash table is allocated once
+
+
+def get_searcher():
+    global _searcher
+    if _searcher is None:
+        _searcher = search.Search()
+    return _searcher
+
+
+#Replays one game and returns its row. depth (None for no evaluation) and every control the search scores.
+def replay(number, headers, movetext, depth=None, every=1):
+    start = time.perf_counter()
+    sans, result = pgn.parse_movetext(movetext)
+    if result == '*':
+        result = headers.get('Result', '*')
+    row = {'number': number, 'event': headers.get('Event', '?'), 'white': headers.get('White', '?'),
+           'black': headers.get('Black', '?'), 'date': headers.get('Date', '?'), 'result': result,
+           'termination': '', 'plies': 0, 'white_captures': 0, 'black_captures': 0, 'white_checks': 0,
+           'black_checks': 0, 'white_castled': '', 'black_castled': '', 'promotions': 0, 'final_fen': '',
+           'evals': [], 'max_swing': None, 'error': ''}
+    gs = None
+    try:
+        gs = Engine.GameState.from_fen(headers['FEN']) if 'FEN' in headers else Engine.GameState()
+        for san in sans:
+            if depth is not None and row['plies'] % every == 0:
+                row['evals'].append(white_score(gs, depth))
+            move = gs.parse_san(san)
+            side = 'white' if gs.white_to_move else 'black'
+            if move.captured != '--':
+                row[side + '_captures'] += 1
+            if move.castle:
+                row[side + '_castled'] = 'O-O' if move.end_col > move.start_col else 'O-O-O'
+            if move.pawn_promo:
+                row['promotions'] += 1
+            gs.make_move(move)
+            row['plies'] += 1
+            king = gs.wK_location if gs.white_to_move else gs.bK_location #from the board, PGNs may leave out '+'
+            if gs.square_under_attack(king[0], king[1], 'w' if gs.white_to_move else 'b'):
+                row[side + '_checks'] += 1
+        if depth is not None:
+            row['evals'].append(white_score(gs, depth))
+        row['termination'] = termination(gs) or headers.get('Termination', 'unterminated' if result == '*' else '')
+    except ValueError as error:
+        row['error'] = "ply %d: %s" % (row['plies'] + 1, error)
+    row['final_fen'] = gs.to_fen() if gs is not None else ''
+    #mate scores aren't centipawns, so a swing to or from one isn't measured
+    swings = [abs(b - a) for a, b in zip(row['evals'], row['evals'][1:])
+              if abs(a) <= search.MATE_BOUND and abs(b) <= search.MATE_BOUND]
+    if swings:
+        row['max_swing'] = max(swings)
+    row['seconds'] = round(time.perf_counter() - start, 4)
+    return row
+
+
+#Search score of the position from white's point of view
+def white_score(gs, depth):
+    score = get_searcher().search(gs, depth=depth).score
+    return score if gs.white_to_move else -score
+
+
+#How the game ended on the board, or '' if the last position isn't terminal
+def termination(gs):
+    if not gs.has_legal_move():
+        return 'checkmate' if gs.in_check else 'stalemate'
+    if gs.is_repetition(3):
+        return 'threefold repetition'
+    if gs.is_fifty_move_rule():
+        return 'fifty-move rule'
+    if selfplay.insufficient_material(gs.board):
+        return 'insufficient material'
+    return ''
+
+
+#Replays a chunk of games; runs in a worker process. task is (first game number, [(headers, movetext)], depth,
+#every).
+def analyze_chunk(task):
+    first, games, depth, every = task
+    return [replay(first + i, headers, movetext, depth, every) for i, (headers, movetext) in enumerate(games)]
+
+
+#Groups (headers, movetext) pairs into (first game number, list) chunks
+def chunk_games(games, size):
+    chunk, first = [], 1
+    for number, game in enumerate(games, 1):
+        chunk.append(game)
+        if len(chunk) == size:
+            yield first, chunk
+            chunk, first = [], number + 1
+    if chunk:
+        yield first, chunk
+
+
+class RowWriter():
+    #Writes rows to out as CSV (with a header line) or JSON lines, flushing after every chunk
+    def __init__(self, out, fmt='csv'):
+        self.out = out
+        self.csv = csv.DictWriter(out, CSV_FIELDS, extrasaction='ignore') if fmt == 'csv' else None
+        if self.csv is not None:
+            self.csv.writeheader()
+
+    def write(self, rows):
+        for row in rows:
+            if self.csv is not None:
+                self.csv.writerow(dict(row, evals=' '.join(str(score) for score in row['evals'])))
+            else:
+                self.out.write(json.dumps(row) + '\n')
+        self.out.flush()
+
+
+#Analyzes every game of the PGN file at path and writes the rows to out (a file object). At most `backlog`
+#chunks per worker are queued at once. Returns a summary dict.
+def run_analysis(path, out, fmt='csv', workers=None, chunk_size=64, depth=None, every=1, backlog=2):
+    workers = workers or os.cpu_count() or 1
+    writer = RowWriter(out, fmt)
+    summary = {'games': 0, 'plies': 0, 'errors': 0, 'results': {}}
+    start = time.perf_counter()
+
+    def record(rows):
+        writer.write(rows)
+        for row in rows:
+            summary['games'] += 1
+            summary['plies'] += row['plies']
+            summary['errors'] += 1 if row['error'] else 0
+            summary['results'][row['result']] = summary['results'].get(row['result'], 0) + 1
+
+    with open(path, encoding='utf-8', errors='replace') as f:
+        tasks = ((first, games, depth, every) for first, games in chunk_games(pgn.read_games(f), chunk_size))
+        if workers == 1:
+            for task in tasks:
+                record(analyze_chunk(task))
+        else:
+            with ProcessPoolExecutor(workers) as pool:
+                pending = collections.deque()
+                for task in tasks:
+                    pending.append(pool.submit(analyze_chunk, task))
+                    if len(pending) >= workers * backlog:
+                        record(pending.popleft().result())
+                while pending:
+                    record(pending.popleft().result())
+    summary['seconds'] = time.perf_counter() - start
+    summary['games_per_second'] = summary['games'] / summary['seconds'] if summary['seconds'] else 0.0
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay and analyze the games of a PGN file on a process pool.")
+    parser.add_argument("path", help="PGN file")
+    parser.add_argument("--out", help="output file, JSON lines if it ends in .jsonl/.json (default: CSV on stdout)")
+    parser.add_argument("--format", choices=('csv', 'jsonl'), help="output format (default: from --out)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk", type=int, default=64, help="games per worker task (default 64)")
+    parser.add_argument("--depth", type=int, help="search depth for position scores (default: no scores)")
+    parser.add_argument("--every", type=int, default=1, help="score every n-th ply (default 1)")
+    args = parser.parse_args(argv)
+    fmt = args.format or ('jsonl' if args.out and args.out.endswith(('.jsonl', '.json')) else 'csv')
+
+    out = open(args.out, 'w', newline='' if fmt == 'csv' else None) if args.out else sys.stdout
+    try:
+        summary = run_analysis(args.path, out, fmt, args.workers, max(args.chunk, 1), args.depth,
+                               max(args.every, 1))
+    finally:
+        if args.out:
+            out.close()
+    print("%d games, %d plies, %d errors in %.1fs (%.1f games/s); results %s" % (
+        summary['games'], summary['plies'], summary['errors'], summary['seconds'], summary['games_per_second'],
+        ' '.join("%s: %d" % item for item in sorted(summary['results'].items()))), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+# Batched position features and evaluation with NumPy.
+# Converts many positions at once into an (N, 12, 8, 8) uint8 tensor of piece planes and scores them with
+# array operations: material and piece-square tables (the same tables as evaluation.py), mobility and pawn
+# structure. Used for dataset generation and for scoring whole batches of leaves.
+# Usage:
+#   python batch_eval.py --positions 2000     time batch scoring against the one-at-a-time evaluation
+import argparse
+import itertools
+import random
+import sys
+import time
+
+import numpy as np
+
+import Engine
+import evaluation
+
+#plane index of each piece code, white pieces first
+PLANE_ORDER = ['wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK']
+
+MG_PLANES = np.array([evaluation.MG_SCORES[piece] for piece in PLANE_ORDER], dtype=np.int32).reshape(12, 8, 8)
+EG_PLANES = np.array([evaluation.EG_SCORES[piece] for piece in PLANE_ORDER], dtype=np.int32).reshape(12, 8, 8)
+PHASE_VECTOR = np.array([evaluation.PHASE[piece] for piece in PLANE_ORDER], dtype=np.int32)
+MATERIAL_VECTOR = np.array([(1 if piece[0] == 'w' else -1) * evaluation.MG_VALUES[piece[1]] for piece in PLANE_ORDER],
+                           dtype=np.int32)
+
+#centipawns per attacked square not occupied by a friendly piece
+MOBILITY_WEIGHTS = {'N': 4, 'B': 5, 'R': 2, 'Q': 1}
+DOUBLED_PAWN_PENALTY = 15
+ISOLATED_PAWN_PENALTY = 12
+#passed pawn bonus by how many rows the pawn has advanced from its own back rank
+PASSED_PAWN_BONUS = np.array([0, 5, 10, 20, 35, 60, 100, 0], dtype=np.int32)
+
+KNIGHT_JUMPS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+STRAIGHT = ((-1, 0), (0, -1), (1, 0), (0, 1))
+DIAGONAL = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+
+
+#(N, 12, 8, 8) uint8 planes for a list of GameStates (either backend, anything with a .board)
+def states_to_planes(states):
+    squares = np.array([list(itertools.chain.from_iterable(gs.board)) for gs in states], dtype='<U2')
+    squares = squares.reshape(len(states), 1, 8, 8)
+    return (squares == np.array(PLANE_ORDER, dtype='<U2').reshape(1, 12, 1, 1)).astype(np.uint8)
+
+
+#Moves every set square of a stack of (N, 8, 8) boards by (dr, dc), dropping whatever falls off the edge
+def shift(boards, dr, dc):
+    result = np.zeros_like(boards)
+    rows_to = slice(max(dr, 0), 8 + min(dr, 0))
+    rows_from = slice(max(-dr, 0), 8 + min(-dr, 0))
+    cols_to = slice(max(dc, 0), 8 + min(dc, 0))
+    cols_from = slice(max(-dc, 0), 8 + min(-dc, 0))
+    result[:, rows_to, cols_to] = boards[:, rows_from, cols_from]
+    return result
+
+
+#Squares a stack of sliders attack along the given directions, stopping at (and including) the first piece
+def slider_attacks(sliders, empty, directions):
+    attacks = np.zeros_like(sliders)
+    for dr, dc in directions:
+        ray = shift(sliders, dr, dc)
+        for _ in range(7):
+            attacks |= ray
+            ray = shift(ray & empty, dr, dc)
+            if not ray.any():
+                break
+    return attacks
+
+
+#Weighted count of the squares one side's knights, bishops, rooks and queens attack that are not occupied by
+#its own pieces, an (N,) int32 array. Works on whole planes, so a square attacked by two pieces of the same
+#type counts once.
+def mobility(planes, side):
+    offset = 0 if side == 'w' else 6
+    own = planes[:, offset:offset + 6].any(axis=1)
+    empty = ~planes.any(axis=1)
+    score = np.zeros(planes.shape[0], dtype=np.int32)
+    knights = planes[:, offset + 1].astype(bool)
+    attacks = np.zeros_like(knights)
+    for dr, dc in KNIGHT_JUMPS:
+        attacks |= shift(knights, dr, dc)
+    score += MOBILITY_WEIGHTS['N'] * (attacks & ~own).sum(axis=(1, 2), dtype=np.int32)
+    for kind, plane, directions in (('B', 2, DIAGONAL), ('R', 3, STRAIGHT), ('Q', 4, STRAIGHT + DIAGONAL)):
+        attacks = slider_attacks(planes[:, offset + plane].astype(bool), empty, directions)
+        score += MOBILITY_WEIGHTS[kind] * (attacks & ~own).sum(axis=(1, 2), dtype=np.int32)
+    return score
+
+
+#Doubled, isolated and passed pawn counts/bonus for both sides, each an (N,) int32 array
+def pawn_structure(planes):
+    white = planes[:, 0].astype(bool)
+    black = planes[:, 6].astype(bool)
+    features = {}
+    for side, pawns, enemy in (('w', white, black), ('b', black, white)):
+        per_file = pawns.sum(axis=1, dtype=np.int32) #(N, 8)
+        features[side + '_doubled'] = np.maximum(per_file - 1, 0).sum(axis=1, dtype=np.int32)
+        has_file = per_file > 0
+        neighbours = np.zeros_like(has_file)
+        neighbours[:, 1:] |= has_file[:, :-1]
+        neighbours[:, :-1] |= has_file[:, 1:]
+        features[side + '_isolated'] = (per_file * ~neighbours).sum(axis=1, dtype=np.int32)
+
+        #enemy pawns anywhere in front of each square, on its own or a neighbouring file
+        if side == 'w': #white moves toward row 0, "in front" is the rows above
+            ahead = np.logical_or.accumulate(enemy, axis=1)
+            ahead = shift(ahead, 1, 0)
+            advanced = 7 - np.arange(8)
+        else:
+            ahead = np.logical_or.accumulate(enemy[:, ::-1], axis=1)[:, ::-1]
+            ahead = shift(ahead, -1, 0)
+            advanced = np.arange(8)
+        blocked = ahead | shift(ahead, 0, 1) | shift(ahead, 0, -1)
+        passed = pawns & ~blocked
+        bonus_by_row = PASSED_PAWN_BONUS[advanced].reshape(1, 8, 1)
+        features[side + '_passed'] = passed.sum(axis=(1, 2), dtype=np.int32)
+        features[side + '_passed_bonus'] = (passed * bonus_by_row).sum(axis=(1, 2), dtype=np.int32)
+    return features
+
+
+#Every feature used by evaluate_batch, as a dict of (N,) arrays; scores are from white's point of view
+def extract_features(planes):
+    planes_i = planes.astype(np.int32)
+    features = {
+        'material': planes_i.sum(axis=(2, 3)) @ MATERIAL_VECTOR,
+        'mg': np.einsum('npij,pij->n', planes_i, MG_PLANES),
+        'eg': np.einsum('npij,pij->n', planes_i, EG_PLANES),
+        'phase': planes_i.sum(axis=(2, 3)) @ PHASE_VECTOR,
+        'w_mobility': mobility(planes, 'w'),
+        'b_mobility': mobility(planes, 'b'),
+    }
+    features.update(pawn_structure(planes))
+    return features
+
+
+#Tapered piece-square score (identical to evaluation.evaluate) plus mobility and pawn structure terms.
+#Returns an (N,) int32 array of scores for the side to move.
+def evaluate_batch(planes, white_to_move, features=None):
+    if features is None:
+        features = extract_features(planes)
+    phase = np.minimum(features['phase'], evaluation.MAX_PHASE)
+    score = (features['mg'] * phase + features['eg'] * (evaluation.MAX_PHASE - phase)) // evaluation.MAX_PHASE
+    score = score + features['w_mobility'] - features['b_mobility']
+    score = score - DOUBLED_PAWN_PENALTY * (features['w_doubled'] - features['b_doubled'])
+    score = score - ISOLATED_PAWN_PENALTY * (features['w_isolated'] - features['b_isolated'])
+    score = score + features['w_passed_bonus'] - features['b_passed_bonus']
+    return np.where(np.asarray(white_to_move, dtype=bool), score, -score).astype(np.int32)
+
+
+#Scores a list of GameStates in one call
+def evaluate_states(states):
+    return evaluate_batch(states_to_planes(states), [gs.white_to_move for gs in states])
+
+
+#Positions reached by short random games from the start position, for benchmarking
+def random_positions(count, max_plies=60, seed=0):
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        gs = Engine.GameState()
+        for _ in range(rng.randint(4, max_plies)):
+            moves = [move for move in gs.get_valid_moves() if not move.pawn_promo]
+            if not moves:
+                break
+            gs.make_move(rng.choice(moves))
+        positions.append(gs)
+    return positions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time batched evaluation against one-at-a-time evaluation.")
+    parser.add_argument("--positions", type=int, default=1000)
+    args = parser.parse_args(argv)
+    states = random_positions(args.positions)
+
+    start = time.perf_counter()
+    planes = states_to_planes(states)
+    convert = time.perf_counter() - start
+    start = time.perf_counter()
+    scores = evaluate_batch(planes, [gs.white_to_move for gs in states])
+    batched = time.perf_counter() - start
+    start = time.perf_counter()
+    for gs in states:
+        evaluation.evaluate_board(gs)
+    single = time.perf_counter() - start
+    print("planes: %s in %.3fs, batch eval %.3fs (%.0f positions/s), board scan one at a time (material + tables only) %.3fs"
+          % (planes.shape, convert, batched, len(states) / batched if batched else 0.0, single))
+    print("score range %d .. %d" % (scores.min(), scores.max()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
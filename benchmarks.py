@@ -0,0 +1,239 @@
+# Microbenchmark regression suite.
+# Times the engine hot paths (legal move generation, pin/check detection, attack tests, make/undo pairs, Move
+# construction) and the GUI's draw_gamestate on an offscreen pygame surface, over a fixed set of positions.
+# Each benchmark is warmed up, calibrated to about --sample-ms per sample and timed --repeats times; the samples
+# go to a JSON file. Comparing against a baseline flags benchmarks that got slower by more than --threshold
+# and whose slowdown is statistically significant (Welch's t-test) and baseline benchmarks the run is missing,
+# and exits with status 1 if there are any.
+# Usage:
+#   python benchmarks.py --out baseline.json                 record a baseline
+#   python benchmarks.py --baseline baseline.json            run and compare against it
+#   python benchmarks.py --compare baseline.json new.json    compare two saved runs
+#   python benchmarks.py --filter middlegame --no-gui
+import argparse
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import time
+
+import Engine
+
+#(name, fen): an opening, a middlegame, an endgame, a position in check and one full of pins
+POSITIONS = [
+    ("opening", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"),
+    ("middlegame", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10"),
+    ("endgame", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1"),
+    ("in check", "rnbqk1nr/pppp1ppp/8/4p3/1b1P4/8/PPP1PPPP/RNBQKBNR w KQkq - 1 3"),
+    ("pins", "4k3/4r3/8/b7/7b/2N5/4RP2/r1N1KB1q w - - 0 1"),
+]
+
+T_CRITICAL = 3.0 #|t| above this counts as a real difference (about p < 0.01 for the sample sizes used here)
+
+
+#{name: (function running one operation, items the operation covers)} for a position. Names don't depend on
+#the position, so runs stay comparable if the move generator changes how many moves it finds; the item count
+#goes into the results instead. Every function works on its own GameState.
+def engine_benchmarks(fen):
+    gs = Engine.GameState.from_fen(fen)
+    moves = gs.get_valid_moves()
+    squares = [(move.start_row, move.start_col, move.end_row, move.end_col) for move in moves]
+    ally = 'w' if gs.white_to_move else 'b'
+    board = gs.board
+
+    def get_valid_moves():
+        gs.get_valid_moves()
+
+    def check_pins_and_checks():
+        gs.check_pins_and_checks()
+
+    def square_under_attack(): #every square once
+        for row in range(8):
+            for col in range(8):
+                gs.square_under_attack(row, col, ally)
+
+    def make_undo(): #every legal move once
+        for move in moves:
+            gs.make_move(move)
+            gs.undo_move()
+
+    def move_construction(): #one Move per legal move
+        for start_row, start_col, end_row, end_col in squares:
+            Engine.Move((start_row, start_col), (end_row, end_col), board)
+
+    return {'get_valid_moves': (get_valid_moves, 1), 'check_pins_and_checks': (check_pins_and_checks, 1),
+            'square_under_attack x64': (square_under_attack, 64), 'make_move/undo_move': (make_undo, len(moves)),
+            'Move()': (move_construction, len(moves))}
+
+
+#{name: (function, 1)} for main.draw_gamestate on an offscreen display: a full redraw of all 64 squares, and the
+#incremental redraw after a move (two squares). None if pygame isn't available.
+def gui_benchmarks(fen):
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    try:
+        import pygame as p
+        import main
+    except ImportError:
+        return None
+    p.display.init()
+    screen = p.display.set_mode((main.WIDTH, main.HEIGHT))
+    if not main.IMAGES:
+        cwd = os.getcwd()
+        os.chdir(os.path.dirname(os.path.abspath(__file__))) #images/ is relative to the repository
+        try:
+            main.load_images()
+        finally:
+            os.chdir(cwd)
+    board_surface = main.render_board()
+    overlays = {'selected': main.square_overlay(main.SELECTED_COLOR), 'target': main.square_overlay(main.TARGET_COLOR)}
+    gs = Engine.GameState.from_fen(fen)
+    moves = gs.get_valid_moves()
+    drawn = [[None] * main.DIMENSION for _ in range(main.DIMENSION)]
+
+    def full_redraw():
+        for row in drawn:
+            row[:] = [None] * main.DIMENSION
+        main.draw_gamestate(screen, gs, board_surface, overlays, drawn, (), moves)
+
+    def move_redraw(): #play and take back the first move, each redraws the two squares it changed
+        gs.make_move(moves[0])
+        main.draw_gamestate(screen, gs, board_surface, overlays, drawn, (), moves)
+        gs.undo_move()
+        main.draw_gamestate(screen, gs, board_surface, overlays, drawn, (), moves)
+
+    full_redraw()
+    return {'draw_gamestate full': (full_redraw, 1), 'draw_gamestate move+undo': (move_redraw, 1)}
+
+
+#Samples of seconds per operation: warms up, picks a number of operations per sample that takes about
+#sample_seconds, then times `repeats` samples
+def measure(function, repeats=15, sample_seconds=0.01):
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= sample_seconds / 2:
+            break
+        number *= 2
+    number = max(1, int(number * sample_seconds / elapsed))
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        samples.append((time.perf_counter() - start) / number)
+    return samples, number
+
+
+#Runs every benchmark whose "position/name" contains name_filter. Returns the JSON-able run dict; its 'gui'
+#says whether the draw_gamestate benchmarks ran (not with gui False or without pygame).
+def run(repeats=15, sample_seconds=0.01, name_filter='', gui=True, out=sys.stdout):
+    results = {}
+    for position, fen in POSITIONS:
+        benchmarks = engine_benchmarks(fen)
+        if gui:
+            drawing = gui_benchmarks(fen)
+            gui = drawing is not None
+            benchmarks.update(drawing or {})
+        for name, (function, items) in benchmarks.items():
+            key = "%s/%s" % (position, name)
+            if name_filter not in key:
+                continue
+            samples, number = measure(function, repeats, sample_seconds)
+            results[key] = {'mean': statistics.mean(samples), 'median': statistics.median(samples),
+                            'stdev': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+                            'number': number, 'items': items, 'samples': samples}
+            if out is not None:
+                print("%-48s %10.2f us  +/- %5.1f%%" % (key, results[key]['mean'] * 1e6,
+                      100 * results[key]['stdev'] / results[key]['mean'] if results[key]['mean'] else 0.0), file=out)
+    return {'python': platform.python_version(), 'platform': platform.platform(),
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'repeats': repeats, 'gui': gui, 'results': results}
+
+
+#Welch's t statistic for the difference of the means of two sample lists (positive when b is slower)
+def welch_t(a, b):
+    if len(a) < 2 or len(b) < 2:
+        return 0.0
+    error = math.sqrt(statistics.variance(a) / len(a) + statistics.variance(b) / len(b))
+    if error == 0:
+        return math.inf if statistics.mean(b) > statistics.mean(a) else 0.0
+    return (statistics.mean(b) - statistics.mean(a)) / error
+
+
+#Compares two runs. Returns a list of (name, ratio of the means, t statistic, verdict) for the benchmarks in
+#the baseline, verdict being 'slower', 'faster', 'missing' (not in the current run, ratio and t are None) or ''
+#(within threshold or not significant). The drawing benchmarks only count if the current run did them.
+def compare(baseline, current, threshold=0.05):
+    rows = []
+    for name, base in baseline['results'].items():
+        if '/draw_gamestate' in name and not current.get('gui', True):
+            continue
+        if name not in current['results']:
+            rows.append((name, None, None, 'missing'))
+            continue
+        new = current['results'][name]
+        ratio = new['mean'] / base['mean'] if base['mean'] else 1.0
+        t = welch_t(base['samples'], new['samples'])
+        verdict = ''
+        if ratio > 1 + threshold and t > T_CRITICAL:
+            verdict = 'slower'
+        elif ratio < 1 - threshold and t < -T_CRITICAL:
+            verdict = 'faster'
+        rows.append((name, ratio, t, verdict))
+    return rows
+
+
+#Prints the rows of compare() and returns the failures: the slower benchmarks and those missing from the run
+def report(rows, out=sys.stdout):
+    for name, ratio, t, verdict in rows:
+        if verdict == 'missing':
+            print("%-48s %8s  %8s  MISSING" % (name, '', ''), file=out)
+        else:
+            print("%-48s %+7.1f%%  t %6.1f  %s" % (name, (ratio - 1) * 100, t, verdict.upper()), file=out)
+    slower = [row for row in rows if row[3] == 'slower']
+    missing = [row for row in rows if row[3] == 'missing']
+    print("%d benchmarks compared, %d significantly slower, %d significantly faster, %d missing" % (
+        len(rows) - len(missing), len(slower), sum(1 for row in rows if row[3] == 'faster'), len(missing)),
+        file=out)
+    return slower + missing
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the engine and GUI hot paths and compare against a baseline.")
+    parser.add_argument("--out", help="write the run to this JSON file")
+    parser.add_argument("--baseline", help="compare the run against this JSON file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="compare two saved runs")
+    parser.add_argument("--repeats", type=int, default=15, help="timed samples per benchmark (default 15)")
+    parser.add_argument("--sample-ms", type=float, default=10, help="length of one sample (default 10ms)")
+    parser.add_argument("--threshold", type=float, default=5, help="slowdown in percent worth flagging (default 5)")
+    parser.add_argument("--filter", default='', help="only benchmarks whose position/name contains this")
+    parser.add_argument("--no-gui", action="store_true", help="skip the pygame drawing benchmarks")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        return 1 if report(compare(baseline, current, args.threshold / 100)) else 0
+
+    current = run(max(args.repeats, 2), args.sample_ms / 1000, args.filter, not args.no_gui)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(current, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        #benchmarks filtered out on purpose aren't missing
+        baseline['results'] = {name: result for name, result in baseline['results'].items() if args.filter in name}
+        print()
+        return 1 if report(compare(baseline, current, args.threshold / 100)) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
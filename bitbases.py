@@ -0,0 +1,290 @@
+# Endgame bitbases for king + queen, rook or pawn against a bare king (KQK, KRK, KPK).
+# Generated by retrograde analysis with GameState's own move rules: every position's moves are generated once,
+# then wins are propagated backwards from the mates. One bit per position says whether the side with the extra
+# piece wins; everything else is a draw (a bare king can't win). Positions are indexed with the strong side as
+# white and the board symmetries folded away (KPK: pawn on files a-d, the others: white king in a1-d1-d4), and
+# each table is a flat bit array in its own file, probed through mmap.
+# Usage:
+#   python bitbases.py generate --dir bitbases      build KQK.bb, KRK.bb and KPK.bb (about a minute)
+#   python bitbases.py probe --dir bitbases --fen "8/8/8/4k3/8/8/4P3/4K3 w - - 0 1"
+import argparse
+import collections
+import mmap
+import os
+import struct
+import sys
+import time
+
+import Engine
+
+SIGNATURES = ('KQK', 'KRK', 'KPK') #in generation order, KPK promotes into the other two
+HEADER = struct.Struct('<4s4sI') #magic, signature, number of positions
+MAGIC = b'BBAS'
+
+WIN, DRAW, LOSS = 1, 0, -1
+
+#squares (x = file, y = rank, 0-based from a1) of the a1-d1-d4 triangle the white king is folded into
+TRIANGLE = [(x, y) for y in range(4) for x in range(y, 4)]
+TRIANGLE_INDEX = {square: i for i, square in enumerate(TRIANGLE)}
+
+
+def table_size(signature):
+    if signature == 'KPK':
+        return 24 * 64 * 64 * 2
+    return len(TRIANGLE) * 64 * 64 * 2
+
+
+#Index of a position with white as the strong side. Squares are (x, y) pairs; white_to_move is a bool.
+def position_index(signature, white_king, black_king, piece, white_to_move):
+    if signature == 'KPK':
+        if piece[0] > 3: #mirror the files so the pawn is on a-d
+            white_king, black_king, piece = [(7 - x, y) for x, y in (white_king, black_king, piece)]
+        piece_index = (piece[1] - 1) * 4 + piece[0]
+        return ((piece_index * 64 + white_king[1] * 8 + white_king[0]) * 64
+                + black_king[1] * 8 + black_king[0]) * 2 + (not white_to_move)
+    squares = [white_king, black_king, piece]
+    if squares[0][0] > 3:
+        squares = [(7 - x, y) for x, y in squares]
+    if squares[0][1] > 3:
+        squares = [(x, 7 - y) for x, y in squares]
+    if squares[0][1] > squares[0][0]:
+        squares = [(y, x) for x, y in squares]
+    white_king, black_king, piece = squares
+    return ((TRIANGLE_INDEX[white_king] * 64 + black_king[1] * 8 + black_king[0]) * 64
+            + piece[1] * 8 + piece[0]) * 2 + (not white_to_move)
+
+
+#Every (white king, black king, piece) placement a table has an index for, as (x, y) squares
+def placements(signature):
+    squares = [(x, y) for y in range(8) for x in range(8)]
+    if signature == 'KPK':
+        for y in range(1, 7):
+            for x in range(4):
+                for white_king in squares:
+                    for black_king in squares:
+                        yield white_king, black_king, (x, y)
+    else:
+        for white_king in TRIANGLE:
+            for black_king in squares:
+                for piece in squares:
+                    yield white_king, black_king, piece
+
+
+#Sets up gs (reused for every position, far cheaper than building GameStates) with the given placement
+def set_position(gs, piece_code, white_king, black_king, piece, white_to_move):
+    for row in gs.board:
+        for col in range(8):
+            row[col] = '--'
+    gs.board[7 - white_king[1]][white_king[0]] = 'wK'
+    gs.board[7 - black_king[1]][black_king[0]] = 'bK'
+    gs.board[7 - piece[1]][piece[0]] = piece_code
+    gs.wK_location = (7 - white_king[1], white_king[0])
+    gs.bK_location = (7 - black_king[1], black_king[0])
+    gs.white_to_move = white_to_move
+
+
+#Builds one table. done is a dict of already built tables (signature -> bytearray of results) for promotions.
+#Returns a bytearray with one byte per index: 1 if white wins, 0 otherwise.
+def generate(signature, done):
+    size = table_size(signature)
+    piece_code = 'w' + ('p' if signature == 'KPK' else signature[1])
+    gs = Engine.GameState()
+    gs.wK_castle = gs.wQ_castle = gs.bK_castle = gs.bQ_castle = False
+    gs.enPassant = ()
+
+    win = bytearray(size)
+    known = bytearray(size) #1 once an index is settled (won, or a legal position that can never be won)
+    waiting = {} #black-to-move index -> number of its moves not yet known to lose
+    predecessors = collections.defaultdict(list)
+    queue = collections.deque()
+
+    for white_king, black_king, piece in placements(signature):
+        if len({white_king, black_king, piece}) < 3:
+            continue
+        if abs(white_king[0] - black_king[0]) <= 1 and abs(white_king[1] - black_king[1]) <= 1:
+            continue
+        #black to move first: whether black is in check also decides if the white-to-move position is legal
+        for white_to_move in (False, True):
+            index = position_index(signature, white_king, black_king, piece, white_to_move)
+            duplicate = known[index] or index in waiting #same position reached through a symmetry
+            if duplicate and white_to_move:
+                continue
+            set_position(gs, piece_code, white_king, black_king, piece, white_to_move)
+            moves = gs.get_valid_moves()
+            if not white_to_move:
+                black_in_check = gs.in_check
+                if duplicate:
+                    continue
+                if not moves:
+                    known[index] = 1
+                    if gs.in_check: #mated
+                        win[index] = 1
+                        queue.append(index)
+                    continue
+                if any(move.captured != '--' for move in moves):
+                    known[index] = 1 #black can take the last white piece
+                    continue
+                waiting[index] = len(moves)
+                for move in moves:
+                    target = (move.end_col, 7 - move.end_row)
+                    predecessors[position_index(signature, white_king, target, piece, True)].append(index)
+            else:
+                if black_in_check:
+                    continue #black king can't be in check with white to move
+                if not moves:
+                    known[index] = 1 #stalemate
+                    continue
+                won = False
+                for move in moves:
+                    target = (move.end_col, 7 - move.end_row)
+                    if move.piece_moved == 'wK':
+                        successor = position_index(signature, target, black_king, piece, False)
+                    elif move.pawn_promo:
+                        if move.promo_piece in ('Q', 'R'):
+                            promoted = 'K' + move.promo_piece + 'K'
+                            successor = position_index(promoted, white_king, black_king, target, False)
+                            won = won or done[promoted][successor]
+                        continue #minor piece promotions are draws
+                    else:
+                        successor = position_index(signature, white_king, black_king, target, False)
+                    predecessors[successor].append(index)
+                if won:
+                    known[index] = win[index] = 1
+                    queue.append(index)
+                else:
+                    waiting[index] = -1 #white positions are won by a single winning move
+
+    #retrograde pass: a white-to-move position is won if any move reaches a won position, a black-to-move
+    #position once every one of its moves does
+    while queue:
+        index = queue.popleft()
+        for predecessor in predecessors.get(index, ()):
+            if known[predecessor]:
+                continue
+            if predecessor & 1: #black to move
+                waiting[predecessor] -= 1
+                if waiting[predecessor]:
+                    continue
+            known[predecessor] = win[predecessor] = 1
+            queue.append(predecessor)
+    return win
+
+
+#Writes a table as a packed bit array (bit i of the data is index i)
+def save_table(path, signature, results):
+    bits = bytearray((len(results) + 7) // 8)
+    for index, value in enumerate(results):
+        if value:
+            bits[index >> 3] |= 1 << (index & 7)
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, signature.encode().ljust(4, b'\0'), len(results)))
+        f.write(bits)
+
+
+#Generates every table into directory. Returns {signature: (won positions, seconds)}.
+def generate_all(directory, progress=None):
+    os.makedirs(directory, exist_ok=True)
+    done, report = {}, {}
+    for signature in SIGNATURES:
+        start = time.perf_counter()
+        done[signature] = generate(signature, done)
+        save_table(os.path.join(directory, signature + '.bb'), signature, done[signature])
+        report[signature] = (sum(done[signature]), time.perf_counter() - start)
+        if progress is not None:
+            progress(signature, *report[signature])
+    return report
+
+
+class Bitbases():
+    #Maps every table file found in directory. Use as a context manager or call close().
+    def __init__(self, directory):
+        self.files = []
+        self.tables = {} #signature -> (mmap, offset of the bit array)
+        for signature in SIGNATURES:
+            path = os.path.join(directory, signature + '.bb')
+            if not os.path.exists(path):
+                continue
+            f = open(path, 'rb')
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, stored, count = HEADER.unpack_from(data, 0)
+            if magic != MAGIC or stored.rstrip(b'\0').decode() != signature or count != table_size(signature):
+                data.close()
+                f.close()
+                raise ValueError("not a %s bitbase: %s" % (signature, path))
+            self.files.append(f)
+            self.tables[signature] = (data, HEADER.size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for data, _ in self.tables.values():
+            data.close()
+        for f in self.files:
+            f.close()
+        self.tables = {}
+        self.files = []
+
+    #WIN, DRAW or LOSS for the side to move, or None if the position isn't in a loaded table. Only a scan for the
+    #three pieces and one bit lookup, no move generation.
+    def probe(self, gs):
+        if not self.tables or abs(gs.material) not in (100, 500, 900) or gs.phase > 4:
+            return None #quick reject using GameState's running scores
+        white_king = black_king = piece = None
+        for row in range(8):
+            for col in range(8):
+                code = gs.board[row][col]
+                if code == '--':
+                    continue
+                if code[1] == 'K':
+                    if code[0] == 'w':
+                        white_king = (col, row)
+                    else:
+                        black_king = (col, row)
+                elif piece is None:
+                    piece, piece_code = (col, row), code
+                else:
+                    return None #more than three pieces
+        if piece is None:
+            return None
+        signature = 'K' + piece_code[1].upper() + 'K'
+        if signature not in self.tables:
+            return None
+        #put the strong side on white: flip the board vertically and swap the colors if it is black
+        if piece_code[0] == 'w':
+            strong_king, weak_king, strong_to_move = white_king, black_king, gs.white_to_move
+            squares = [(x, 7 - row) for x, row in (strong_king, weak_king, piece)]
+        else:
+            strong_king, weak_king, strong_to_move = black_king, white_king, not gs.white_to_move
+            squares = [(x, row) for x, row in (strong_king, weak_king, piece)]
+        index = position_index(signature, squares[0], squares[1], squares[2], strong_to_move)
+        data, offset = self.tables[signature]
+        if not data[offset + (index >> 3)] >> (index & 7) & 1:
+            return DRAW
+        return WIN if strong_to_move else LOSS
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate or probe KQK/KRK/KPK bitbases.")
+    parser.add_argument("command", choices=('generate', 'probe'))
+    parser.add_argument("--dir", default="bitbases", help="directory of the table files (default: bitbases)")
+    parser.add_argument("--fen", help="position to probe")
+    args = parser.parse_args(argv)
+    if args.command == 'generate':
+        def report(signature, won, seconds):
+            print("%s: %d of %d indices won, %.1fs" % (signature, won, table_size(signature), seconds))
+        generate_all(args.dir, report)
+        return 0
+    if not args.fen:
+        parser.error("probe needs --fen")
+    with Bitbases(args.dir) as bitbases:
+        result = bitbases.probe(Engine.GameState.from_fen(args.fen))
+    print({WIN: "win", DRAW: "draw", LOSS: "loss", None: "not in bitbases"}[result])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+# EPD test-suite runner.
+# Streams an EPD file line by line, solves the positions on a process pool and writes one JSON result per
+# line as soon as it is ready (in input order), so files with thousands of positions run in bounded memory.
+# Understood operations:
+#   bm / am     best move / move to avoid, in SAN, checked with a search (--depth, --movetime)
+#   D1 .. Dn    perft leaf counts (perftsuite.epd style), checked up to --perft-depth
+#   id          copied to the output
+# Usage:
+#   python epd.py suite.epd --depth 4 --workers 4 --out results.jsonl
+#   python epd.py perftsuite.epd --perft-depth 3
+import argparse
+import collections
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import Engine
+import perft
+import search
+
+
+#Splits an EPD line into (fen, operations). The position has 4 fields, optionally followed by the two FEN
+#move clocks; operations are "opcode operand...;" groups. Returns None for blank lines and comments.
+def parse_epd(line):
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError("invalid EPD: %s" % line)
+    position = fields[:4]
+    rest = fields[4] if len(fields) > 4 else ''
+    clocks = rest.split(None, 2)
+    if len(clocks) >= 2 and clocks[0].isdigit() and clocks[1].isdigit():
+        position += clocks[:2]
+        rest = clocks[2] if len(clocks) > 2 else ''
+    ops = {}
+    for group in rest.split(';'):
+        tokens = group.split()
+        if tokens:
+            ops[tokens[0]] = [token.strip('"') for token in tokens[1:]]
+    return ' '.join(position), ops
+
+
+#Yields (line number, line) for each non-empty, non-comment line, reading the file lazily. Lines are parsed
+#in the workers, so a malformed one becomes an error result instead of stopping the run.
+def read_epd(path):
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield number, line
+
+
+#Checks one position; runs in a worker process
+def solve(task):
+    number, line, depth, movetime, perft_depth = task
+    start = time.perf_counter()
+    result = {'line': number, 'id': '', 'fen': line}
+    try:
+        fen, ops = parse_epd(line)
+        result.update({'id': ' '.join(ops.get('id', [])), 'fen': fen})
+        gs = Engine.GameState.from_fen(fen)
+        if 'bm' in ops or 'am' in ops:
+            found = search.Search().search(gs, depth=depth, movetime=movetime)
+            best = gs.get_san(found.best_move).rstrip('+#') if found.best_move else None
+            expected = [san.rstrip('+#!?') for san in ops.get('bm', [])]
+            avoid = [san.rstrip('+#!?') for san in ops.get('am', [])]
+            result.update({'kind': 'bestmove', 'best': best, 'expected': expected, 'avoid': avoid,
+                           'score': found.score, 'depth': found.depth, 'nodes': found.nodes,
+                           'passed': best is not None and (not expected or best in expected) and best not in avoid})
+        else:
+            counts = {int(op[1:]): int(values[0]) for op, values in ops.items()
+                      if op[:1] == 'D' and op[1:].isdigit() and values}
+            checked = {}
+            nodes = 0
+            for d in sorted(counts):
+                if d > perft_depth:
+                    break
+                checked[d] = perft.perft(gs, d)
+                nodes += checked[d]
+            result.update({'kind': 'perft', 'counts': checked, 'nodes': nodes,
+                           'passed': all(checked[d] == counts[d] for d in checked)})
+    except Exception as error: #one bad line shouldn't stop a night's run
+        result.update({'kind': 'error', 'error': "%s: %s" % (type(error).__name__, error), 'passed': False})
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+#Runs every position of the file and writes JSON lines to out (a file object). At most `backlog` positions per
+#worker are queued at once. Returns a summary dict.
+def run_epd(path, out, workers=None, depth=None, movetime=None, perft_depth=3, backlog=4):
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    summary = {'positions': 0, 'passed': 0, 'failed': 0, 'errors': 0, 'nodes': 0}
+
+    def record(result):
+        summary['positions'] += 1
+        summary['nodes'] += result.get('nodes', 0)
+        if result['passed']:
+            summary['passed'] += 1
+        elif result['kind'] == 'error':
+            summary['errors'] += 1
+        else:
+            summary['failed'] += 1
+        out.write(json.dumps(result) + '\n')
+        out.flush()
+
+    tasks = ((number, line, depth, movetime, perft_depth) for number, line in read_epd(path))
+    if workers == 1:
+        for task in tasks:
+            record(solve(task))
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            pending = collections.deque()
+            for task in tasks:
+                pending.append(pool.submit(solve, task))
+                if len(pending) >= workers * backlog:
+                    record(pending.popleft().result())
+            while pending:
+                record(pending.popleft().result())
+    summary['seconds'] = time.perf_counter() - start
+    summary['positions_per_second'] = summary['positions'] / summary['seconds'] if summary['seconds'] else 0.0
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run an EPD test suite on a process pool.")
+    parser.add_argument("path", help="EPD file")
+    parser.add_argument("--out", help="JSON lines output file (default: stdout)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--depth", type=int, help="search depth for bm/am positions")
+    parser.add_argument("--movetime", type=int, help="search time per bm/am position in milliseconds")
+    parser.add_argument("--perft-depth", type=int, default=3, help="deepest D<n> count to check (default 3)")
+    args = parser.parse_args(argv)
+    if args.depth is None and args.movetime is None:
+        args.depth = 3
+
+    out = open(args.out, 'w') if args.out else sys.stdout
+    try:
+        summary = run_epd(args.path, out, args.workers, args.depth,
+                          args.movetime / 1000 if args.movetime else None, args.perft_depth)
+    finally:
+        if args.out:
+            out.close()
+    print("%d positions: %d passed, %d failed, %d errors in %.1fs (%.1f positions/s)" % (
+        summary['positions'], summary['passed'], summary['failed'], summary['errors'], summary['seconds'],
+        summary['positions_per_second']), file=sys.stderr)
+    return 0 if summary['failed'] == 0 and summary['errors'] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
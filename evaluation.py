@@ -0,0 +1,148 @@
+# Static evaluation of a GameState.
+# Material plus piece-square tables, with separate middlegame and endgame tables blended by the game phase
+# (how much non-pawn material is left). Scores are in centipawns.
+
+#middlegame and endgame material values, the king's is irrelevant since it never leaves the board
+MG_VALUES = {'p': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 0}
+EG_VALUES = {'p': 120, 'N': 300, 'B': 320, 'R': 530, 'Q': 950, 'K': 0}
+
+#phase contribution of each piece, the start position adds up to MAX_PHASE
+PHASE_WEIGHTS = {'p': 0, 'N': 1, 'B': 1, 'R': 2, 'Q': 4, 'K': 0}
+MAX_PHASE = 24
+
+#Piece-square tables from white's point of view, laid out like GameState.board (first row is rank 8)
+PAWN_TABLE = [
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [50, 50, 50, 50, 50, 50, 50, 50],
+    [10, 10, 20, 30, 30, 20, 10, 10],
+    [5, 5, 10, 25, 25, 10, 5, 5],
+    [0, 0, 0, 20, 20, 0, 0, 0],
+    [5, -5, -10, 0, 0, -10, -5, 5],
+    [5, 10, 10, -20, -20, 10, 10, 5],
+    [0, 0, 0, 0, 0, 0, 0, 0],
+]
+PAWN_ENDGAME_TABLE = [
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [80, 80, 80, 80, 80, 80, 80, 80],
+    [50, 50, 50, 50, 50, 50, 50, 50],
+    [30, 30, 30, 30, 30, 30, 30, 30],
+    [15, 15, 15, 15, 15, 15, 15, 15],
+    [5, 5, 5, 5, 5, 5, 5, 5],
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [0, 0, 0, 0, 0, 0, 0, 0],
+]
+KNIGHT_TABLE = [
+    [-50, -40, -30, -30, -30, -30, -40, -50],
+    [-40, -20, 0, 0, 0, 0, -20, -40],
+    [-30, 0, 10, 15, 15, 10, 0, -30],
+    [-30, 5, 15, 20, 20, 15, 5, -30],
+    [-30, 0, 15, 20, 20, 15, 0, -30],
+    [-30, 5, 10, 15, 15, 10, 5, -30],
+    [-40, -20, 0, 5, 5, 0, -20, -40],
+    [-50, -40, -30, -30, -30, -30, -40, -50],
+]
+BISHOP_TABLE = [
+    [-20, -10, -10, -10, -10, -10, -10, -20],
+    [-10, 0, 0, 0, 0, 0, 0, -10],
+    [-10, 0, 5, 10, 10, 5, 0, -10],
+    [-10, 5, 5, 10, 10, 5, 5, -10],
+    [-10, 0, 10, 10, 10, 10, 0, -10],
+    [-10, 10, 10, 10, 10, 10, 10, -10],
+    [-10, 5, 0, 0, 0, 0, 5, -10],
+    [-20, -10, -10, -10, -10, -10, -10, -20],
+]
+ROOK_TABLE = [
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [5, 10, 10, 10, 10, 10, 10, 5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [0, 0, 0, 5, 5, 0, 0, 0],
+]
+QUEEN_TABLE = [
+    [-20, -10, -10, -5, -5, -10, -10, -20],
+    [-10, 0, 0, 0, 0, 0, 0, -10],
+    [-10, 0, 5, 5, 5, 5, 0, -10],
+    [-5, 0, 5, 5, 5, 5, 0, -5],
+    [0, 0, 5, 5, 5, 5, 0, -5],
+    [-10, 5, 5, 5, 5, 5, 0, -10],
+    [-10, 0, 5, 0, 0, 0, 0, -10],
+    [-20, -10, -10, -5, -5, -10, -10, -20],
+]
+KING_TABLE = [
+    [-30, -40, -40, -50, -50, -40, -40, -30],
+    [-30, -40, -40, -50, -50, -40, -40, -30],
+    [-30, -40, -40, -50, -50, -40, -40, -30],
+    [-30, -40, -40, -50, -50, -40, -40, -30],
+    [-20, -30, -30, -40, -40, -30, -30, -20],
+    [-10, -20, -20, -20, -20, -20, -20, -10],
+    [20, 20, 0, 0, 0, 0, 20, 20],
+    [20, 30, 10, 0, 0, 10, 30, 20],
+]
+KING_ENDGAME_TABLE = [
+    [-50, -40, -30, -20, -20, -30, -40, -50],
+    [-30, -20, -10, 0, 0, -10, -20, -30],
+    [-30, -10, 20, 30, 30, 20, -10, -30],
+    [-30, -10, 30, 40, 40, 30, -10, -30],
+    [-30, -10, 30, 40, 40, 30, -10, -30],
+    [-30, -10, 20, 30, 30, 20, -10, -30],
+    [-30, -30, 0, 0, 0, 0, -30, -30],
+    [-50, -30, -30, -30, -30, -30, -30, -50],
+]
+
+MG_TABLES = {'p': PAWN_TABLE, 'N': KNIGHT_TABLE, 'B': BISHOP_TABLE, 'R': ROOK_TABLE, 'Q': QUEEN_TABLE,
+             'K': KING_TABLE}
+EG_TABLES = {'p': PAWN_ENDGAME_TABLE, 'N': KNIGHT_TABLE, 'B': BISHOP_TABLE, 'R': ROOK_TABLE, 'Q': QUEEN_TABLE,
+             'K': KING_ENDGAME_TABLE}
+
+
+#For every piece code a 64-entry list (index row * 8 + col) of material + table value, positive for white
+#and negative for black, so a position's score is just the sum over its pieces
+def _signed_tables(values, tables):
+    signed = {}
+    for kind in values:
+        signed['w' + kind] = [values[kind] + tables[kind][sq // 8][sq % 8] for sq in range(64)]
+        signed['b' + kind] = [-(values[kind] + tables[kind][7 - sq // 8][sq % 8]) for sq in range(64)]
+    return signed
+
+
+MG_SCORES = _signed_tables(MG_VALUES, MG_TABLES)
+EG_SCORES = _signed_tables(EG_VALUES, EG_TABLES)
+PHASE = {color + kind: weight for color in 'wb' for kind, weight in PHASE_WEIGHTS.items()}
+MATERIAL = {color + kind: (1 if color == 'w' else -1) * value for color in 'wb' for kind, value in MG_VALUES.items()}
+
+
+#Blends middlegame and endgame scores by phase (MAX_PHASE = all pieces on, 0 = pawns and kings only)
+def taper(mg, eg, phase):
+    phase = min(phase, MAX_PHASE)
+    return (mg * phase + eg * (MAX_PHASE - phase)) // MAX_PHASE
+
+
+#Scans the board and returns (middlegame score, endgame score, phase, material), scores from white's point of view
+def score_board(board):
+    mg = eg = phase = material = 0
+    for row in range(8):
+        for col in range(8):
+            piece = board[row][col]
+            if piece != '--':
+                mg += MG_SCORES[piece][row * 8 + col]
+                eg += EG_SCORES[piece][row * 8 + col]
+                phase += PHASE[piece]
+                material += MATERIAL[piece]
+    return mg, eg, phase, material
+
+
+#Score of the position for the side to move. Uses the scores GameState keeps up to date in make_move and
+#undo_move, so it doesn't look at the board at all.
+def evaluate(gs):
+    score = taper(gs.mg_score, gs.eg_score, gs.phase)
+    return score if gs.white_to_move else -score
+
+
+#Same score computed by scanning the board, for positions without running scores (e.g. bitboard.GameState)
+def evaluate_board(gs):
+    mg, eg, phase, _ = score_board(gs.board)
+    score = taper(mg, eg, phase)
+    return score if gs.white_to_move else -score
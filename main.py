@@ -1,46 +1,90 @@
-# Main driver file. 
-# Handles user input and displays the current game state. 
-import Engine 
+# Main driver file.
+# Handles user input and displays the current game state.
+# The board squares are rendered once into a surface; after that only the squares whose piece or highlight
+# changed are redrawn and pushed to the screen with display.update. Engine moves are searched in a separate
+# process, so the window keeps responding while the engine thinks and sleeps when nothing is happening.
+# Usage:
+#   python main.py                              player vs player
+#   python main.py --ai black --movetime 2000   play white against the engine
+#   python main.py --book book.bin              'b' plays a Polyglot book move
+import argparse
+import itertools
+import queue
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import Engine
+import perft
+import polyglot
 import pygame as p
+import search
 
 WIDTH = HEIGHT = 512
-DIMENSION = 8 
+DIMENSION = 8
 SQ_SIZE = HEIGHT // DIMENSION #size of each board square
-MAX_FPS = 15 
-IMAGES: dict[str, str] = {}  
+MAX_FPS = 60 #frame cap while the engine is thinking
+IDLE_WAIT = 500 #otherwise the loop sleeps until an event arrives, waking at least this often (ms)
+IMAGES: dict[str, str] = {}
+SELECTED_COLOR = (246, 246, 105, 150)
+TARGET_COLOR = (20, 85, 30, 90)
 
 #Initializes a global dictionary of images
 def load_images():
     pieces = ['bB', 'bK', 'bN', 'bp', 'bQ', 'bR', 'wB', 'wK', 'wN', 'wp', 'wQ', 'wR']
     for piece in pieces:
-        IMAGES[piece] = p.transform.scale(p.image.load("images/" + piece + ".png"), (SQ_SIZE, SQ_SIZE))
+        IMAGES[piece] = p.transform.scale(p.image.load("images/" + piece + ".png"), (SQ_SIZE, SQ_SIZE)).convert_alpha()
     #Access: IMAGES['wK'], etc
 
 
-#The main driver for our code. 
+#Runs in the engine process: the move name (e2e4) the search picks for gs, or None if there is no move
+def search_move(gs, movetime):
+    result = search.Search().search(gs, movetime=movetime)
+    return perft.move_name(result.best_move) if result.best_move else None
+
+
+#The main driver for our code.
 #Handles user input and updating the graphics
-def main():
+#book_path is an optional Polyglot book: pressing 'b' plays one of its moves for the current position
+#ai_colors is the set of sides ('w', 'b') the engine plays; 'e' asks the engine to move for either side
+def main(book_path=None, ai_colors=(), movetime=1.0):
     p.init()
     screen = p.display.set_mode((WIDTH, HEIGHT))
     p.display.set_caption("Sahil's Chess Engine")
     clock = p.time.Clock()
-    screen.fill(p.Color("white"))
+    load_images()
+    board_surface = render_board()
+    overlays = {'selected': square_overlay(SELECTED_COLOR), 'target': square_overlay(TARGET_COLOR)}
     gs = Engine.GameState()
-    valid_moves = gs.get_valid_moves()
+    gs.move_cache = Engine.MoveCache() #undo ('z') and replies to the same moves come back to known positions
+    book = polyglot.OpeningBook(book_path) if book_path else None
+    valid_moves = gs.get_valid_moves() #cached until the position changes, clicks only look things up
     move_made = False #flag variable for when move is made
-    load_images()
     running = True
     selected_sq = () #default is no selected square, stores a tuple (row,col)
     player_clicks = [] #keeps track of clicks, 2 tuples with start(x,y) and end(x,y)
+    drawn = [[None] * DIMENSION for _ in range(DIMENSION)] #(piece, highlight) currently on screen per square
 
+    engine = ProcessPoolExecutor(1)
+    results = queue.Queue() #(position id, move name) from finished engine searches
+    searches = itertools.count(1) #ids for engine searches, so a result for an undone position is recognised
+    thinking = None #id of the running engine search, or None
+    want_engine_move = True #check whether the engine should move in the starting position
 
     while running:
-        for e in p.event.get():
+        if thinking is not None:
+            clock.tick(MAX_FPS)
+            events = p.event.get()
+        else: #nothing to animate, sleep until something happens
+            events = [p.event.wait(IDLE_WAIT)] + p.event.get()
+
+        for e in events:
             if e.type == p.QUIT:
                 running = False
+            elif e.type in (p.VIDEOEXPOSE, p.WINDOWEXPOSED): #window contents were lost, redraw everything
+                drawn = [[None] * DIMENSION for _ in range(DIMENSION)]
             #mouse handler
-            elif e.type == p.MOUSEBUTTONDOWN:
-                location = p.mouse.get_pos() #x,y location
+            elif e.type == p.MOUSEBUTTONDOWN and thinking is None:
+                location = e.pos #x,y location
                 row, col = location[1]//SQ_SIZE, location[0]//SQ_SIZE
                 if selected_sq == (row, col): #selected same square
                     selected_sq = ()
@@ -51,35 +95,147 @@ def main():
                 if len(player_clicks) == 2: #after second click
                     move = Engine.Move(player_clicks[0], player_clicks[1], gs.board)
                     print(move.get_chess_notation())
-                    for i in range(len(valid_moves)):
-                        if move == valid_moves[i]:
-                            gs.make_move(valid_moves[i])
-                            move_made = True
-                            selected_sq = () 
-                            player_clicks = []
+                    #the valid moves between the two squares: one, or one per piece for a promotion
+                    matches = [m for m in valid_moves if m.move_ID == move.move_ID]
+                    if matches:
+                        if matches[0].pawn_promo:
+                            piece = choose_promotion()
+                            matches = [m for m in matches if m.promo_piece == piece]
+                        gs.make_move(matches[0])
+                        move_made = True
+                        selected_sq = ()
+                        player_clicks = []
                     if not move_made:
                         player_clicks = [selected_sq]
             #key handlers
             elif e.type == p.KEYDOWN:
-                if e.key  == p.K_z: #undo when 'z' is pressed
+                if e.key  == p.K_z: #undo when 'z' is pressed, a search still running for the old position is ignored
                     gs.undo_move()
                     move_made = True
+                    thinking = None
+                elif e.key == p.K_b and book is not None and thinking is None: #book move when 'b' is pressed
+                    move = book.choose_move(gs)
+                    if move is not None:
+                        gs.make_move(move)
+                        move_made = True
+                elif e.key == p.K_e and thinking is None and valid_moves: #engine move when 'e' is pressed
+                    thinking = start_search(engine, results, gs, movetime, next(searches))
+
+        #engine results arrive through the queue from the executor's callback thread
+        while not results.empty():
+            search_id, name = results.get()
+            if search_id != thinking:
+                continue #the position changed (undo) while it was searching
+            thinking = None
+            update_caption(gs)
+            for move in valid_moves:
+                if perft.move_name(move) == name:
+                    gs.make_move(move)
+                    move_made = True
+                    break
+
         if move_made:
             valid_moves = gs.get_valid_moves()
             move_made = False
+            selected_sq = ()
+            player_clicks = []
+            want_engine_move = True
+            update_caption(gs)
+        if want_engine_move and thinking is None and valid_moves and (
+                ('w' if gs.white_to_move else 'b') in ai_colors):
+            thinking = start_search(engine, results, gs, movetime, next(searches))
+        want_engine_move = False
+
+        draw_gamestate(screen, gs, board_surface, overlays, drawn, selected_sq, valid_moves)
+
+    engine.shutdown(wait=False, cancel_futures=True)
+    if book is not None:
+        book.close()
+    p.quit()
+
+
+#Hands the position to the engine process; the move name comes back on results tagged with search_id.
+#Returns search_id.
+def start_search(engine, results, gs, movetime, search_id):
+    future = engine.submit(search_move, gs, movetime)
+    future.add_done_callback(lambda f: results.put((search_id, None if f.cancelled() or f.exception() else f.result())))
+    p.display.set_caption("Sahil's Chess Engine - thinking...")
+    return search_id
+
+
+def update_caption(gs):
+    if gs.checkmate:
+        p.display.set_caption("Sahil's Chess Engine - checkmate, %s wins" % ("black" if gs.white_to_move else "white"))
+    elif gs.stalemate:
+        p.display.set_caption("Sahil's Chess Engine - stalemate")
+    else:
+        p.display.set_caption("Sahil's Chess Engine")
 
-        draw_gamestate(screen, gs)
-        clock.tick(MAX_FPS)
-        p.display.flip()
 
-#Draws the given game state 
+#Waits for the promotion piece: q, r, b or n on the keyboard, anything else (or a click) picks a queen
+def choose_promotion():
+    p.display.set_caption("Promote to: Q, R, B or N")
+    keys = {p.K_q: 'Q', p.K_r: 'R', p.K_b: 'B', p.K_n: 'N'}
+    piece = None
+    while piece is None:
+        e = p.event.wait()
+        if e.type == p.KEYDOWN:
+            piece = keys.get(e.key, 'Q')
+        elif e.type == p.MOUSEBUTTONDOWN:
+            piece = 'Q'
+        elif e.type == p.QUIT: #leave it for the main loop
+            p.event.post(e)
+            piece = 'Q'
+    p.display.set_caption("Sahil's Chess Engine")
+    return piece
+
+#Draws the given game state
 #Responsible for all graphics witihin a current game state!
-def draw_gamestate(screen, gs):
-    draw_board(screen) 
-    draw_pieces(screen, gs.board) 
-    
+#Only squares whose piece or highlight differs from what `drawn` says is on screen get redrawn, and only
+#their rectangles are sent to the display
+def draw_gamestate(screen, gs, board_surface, overlays, drawn, selected_sq, valid_moves):
+    targets = set()
+    if selected_sq:
+        targets = {(m.end_row, m.end_col) for m in valid_moves if (m.start_row, m.start_col) == selected_sq}
+    dirty = []
+    for row in range(DIMENSION):
+        for col in range(DIMENSION):
+            highlight = 'selected' if (row, col) == selected_sq else 'target' if (row, col) in targets else None
+            state = (gs.board[row][col], highlight)
+            if drawn[row][col] != state:
+                drawn[row][col] = state
+                dirty.append(draw_square(screen, board_surface, overlays, row, col, state))
+    if dirty:
+        p.display.update(dirty)
+
+
+#Redraws one square from the pre-rendered board, its highlight and its piece. Returns the square's rect.
+def draw_square(screen, board_surface, overlays, row, col, state):
+    piece, highlight = state
+    rect = p.Rect(col*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+    screen.blit(board_surface, rect, rect)
+    if highlight is not None:
+        screen.blit(overlays[highlight], rect)
+    if piece != "--": #not empty square
+        screen.blit(IMAGES[piece], rect)
+    return rect
+
 
-#Draws squares on board    
+#The empty board, drawn once
+def render_board():
+    surface = p.Surface((WIDTH, HEIGHT)).convert()
+    draw_board(surface)
+    return surface
+
+
+#Translucent square used to highlight the selected piece and its legal targets
+def square_overlay(color):
+    overlay = p.Surface((SQ_SIZE, SQ_SIZE), p.SRCALPHA)
+    overlay.fill(color)
+    return overlay
+
+
+#Draws squares on board
 def draw_board(screen):
     colors = [p.Color(227,193,111), p.Color(184,139,74)]
     for row in range(DIMENSION):
@@ -87,14 +243,13 @@ def draw_board(screen):
             color = colors[((row + col) % 2)]
             p.draw.rect(screen, color, p.Rect(col*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE))
 
-#Draws pieces on top of the board
-def draw_pieces(screen, board):
-    for row in range(DIMENSION):
-        for col in range(DIMENSION):
-            piece = board[row][col]
-            if piece != "--": #not empty square 
-                screen.blit(IMAGES[piece], p.Rect(col*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
 #if imported, this will still work!
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Play chess in a pygame window.")
+    parser.add_argument("--book", help="Polyglot opening book, 'b' plays a book move")
+    parser.add_argument("--ai", choices=('white', 'black', 'both', 'none'), default='none',
+                        help="side(s) the engine plays; 'e' makes it move for the side to move")
+    parser.add_argument("--movetime", type=int, default=1000, help="engine time per move in milliseconds")
+    args = parser.parse_args()
+    ai_colors = {'white': ('w',), 'black': ('b',), 'both': ('w', 'b'), 'none': ()}[args.ai]
+    sys.exit(main(args.book, ai_colors, args.movetime / 1000))
@@ -0,0 +1,276 @@
+# Multi-core search.
+# CPython runs one search per process, so parallel search runs several processes, each with its own
+# GameState copy. Two modes:
+#   split     root moves are handed out to the pool and searched independently (deterministic)
+#   lazysmp   every worker searches the whole root position, sharing one transposition table in shared
+#             memory so workers skip subtrees others already finished
+# Usage:
+#   python parallel.py --depth 4 --workers 4
+#   python parallel.py --depth 4 --scaling 1 2 4 8 --mode lazysmp
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import evaluation
+import perft
+import search
+
+
+class SharedTranspositionTable():
+    #Same interface as search.TranspositionTable, but the slots live in a shared memory block that any
+    #process can attach to by name. Each slot is two 64-bit words: key ^ data and data. A slot torn by two
+    #processes writing at once fails the key check on probe and is treated as a miss, so no locking is needed.
+    ENTRY_BYTES = 16
+
+    def __init__(self, size_mb=16, name=None):
+        if name is None:
+            entries = max(1, size_mb * 1024 * 1024 // self.ENTRY_BYTES)
+            self.size = 1 << (entries.bit_length() - 1)
+            self.shm = shared_memory.SharedMemory(create=True, size=self.size * self.ENTRY_BYTES)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.size = self.shm.size // self.ENTRY_BYTES
+            self.size = 1 << (self.size.bit_length() - 1)
+            self.owner = False
+        self.name = self.shm.name
+        self.mask = self.size - 1
+        self.slots = self.shm.buf.cast('Q')
+        self.age = 0
+
+    def close(self):
+        self.slots.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    #Only the process that created the table advances the age, attached workers are handed it per search
+    def new_search(self):
+        if self.owner:
+            self.age = (self.age + 1) & 0x3F
+
+    def clear(self):
+        for i in range(2 * self.size):
+            self.slots[i] = 0
+
+    #data word layout: move (16 bits) | score + 2^31 (32 bits) | depth + 1 (8 bits) | flag (2 bits) | age (6 bits)
+    def probe(self, key):
+        i = (key & self.mask) * 2
+        data = self.slots[i + 1]
+        if data == 0 or self.slots[i] ^ data != key:
+            return None
+        return (((data >> 8) & 0xFF) - 1, ((data >> 16) & 0xFFFFFFFF) - (1 << 31),
+                (data >> 6) & 0x3, data >> 48)
+
+    def store(self, key, depth, score, flag, move):
+        i = (key & self.mask) * 2
+        old = self.slots[i + 1]
+        if old:
+            same = self.slots[i] ^ old == key
+            if not same and old & 0x3F == self.age and ((old >> 8) & 0xFF) - 1 > depth:
+                return
+            if move == 0 and same:
+                move = old >> 48
+        data = ((move << 48) | ((score + (1 << 31)) << 16) | ((min(depth, 126) + 1) << 8)
+                | (flag << 6) | self.age)
+        self.slots[i] = key ^ data
+        self.slots[i + 1] = data
+
+    def hashfull(self):
+        sample = min(1000, self.size)
+        used = sum(1 for i in range(sample) if self.slots[2 * i + 1] and self.slots[2 * i + 1] & 0x3F == self.age)
+        return used * 1000 // sample
+
+
+#Score of a root move from the root side's point of view: search the position after it one ply shallower,
+#stopping at the wall clock time `deadline` (time.time()) or after `nodes` nodes. 'depth' is the depth reached:
+#less than depth if the search was cut short, depth if it finished or proved a mate before getting there.
+def _search_root_move(gs, index, depth, nodes, tt_size_mb, deadline=None):
+    move = perft.legal_moves(gs)[index]
+    gs.make_move(move)
+    start = time.perf_counter()
+    completed = depth
+    if not gs.has_legal_move():
+        score, pv, searched = search.MATE_SCORE - 1 if gs.in_check else 0, [], 1
+    elif depth <= 1:
+        score, pv, searched = -evaluation.evaluate(gs), [], 1
+    else:
+        movetime = deadline - time.time() if deadline is not None else None
+        if movetime is not None and movetime <= 0:
+            return {'index': index, 'depth': 0, 'score': 0, 'pv': [], 'nodes': 0, 'seconds': 0.0}
+        result = search.Search(tt_size_mb).search(gs, depth=depth - 1, movetime=movetime, nodes=nodes)
+        score, pv, searched = -result.score, [perft.move_name(m) for m in result.pv], result.nodes
+        if abs(score) <= search.MATE_BOUND or search.MATE_SCORE - abs(score) > result.depth:
+            completed = result.depth + 1
+        if score > search.MATE_BOUND:
+            score -= 1 #one ply further from the root
+        elif score < -search.MATE_BOUND:
+            score += 1
+    return {'index': index, 'depth': completed, 'score': score, 'pv': [perft.move_name(move)] + pv,
+            'nodes': searched, 'seconds': time.perf_counter() - start}
+
+
+_worker_tt = None
+
+
+def _attach_shared_tt(name):
+    global _worker_tt
+    _worker_tt = SharedTranspositionTable(name=name)
+
+
+#One Lazy SMP helper: a full iterative deepening search of the root with the shared table. Helpers with an
+#odd id start one ply deeper so the workers don't all walk the same tree in lockstep.
+def _lazy_smp_worker(gs, worker_id, depth, movetime, nodes, age):
+    _worker_tt.age = age
+    searcher = search.Search(tt=_worker_tt)
+    if worker_id % 2 and depth:
+        depth += 1
+    result = searcher.search(gs, depth=depth, movetime=movetime, nodes=nodes)
+    root_moves = [perft.move_name(move) for move in perft.legal_moves(gs)]
+    index = root_moves.index(perft.move_name(result.best_move)) if result.best_move else -1
+    return {'worker': worker_id, 'index': index, 'depth': result.depth, 'score': result.score,
+            'pv': [perft.move_name(move) for move in result.pv], 'nodes': result.nodes, 'seconds': result.seconds}
+
+
+#Turns a list of move names back into Move objects by playing them out on gs (which is left unchanged)
+def moves_from_names(gs, names):
+    moves = []
+    for name in names:
+        match = [move for move in perft.legal_moves(gs) if perft.move_name(move) == name]
+        if not match:
+            break
+        moves.append(match[0])
+        gs.make_move(match[0])
+    for _ in moves:
+        gs.undo_move()
+    return moves
+
+
+class ParallelSearch():
+    #A pool of worker processes kept alive between searches. Use as a context manager or call close().
+    def __init__(self, workers=None, mode='split', tt_size_mb=16):
+        self.workers = workers or os.cpu_count() or 1
+        self.mode = mode
+        self.tt_size_mb = tt_size_mb
+        self.shared_tt = None
+        if mode == 'lazysmp':
+            self.shared_tt = SharedTranspositionTable(tt_size_mb)
+            self.pool = ProcessPoolExecutor(self.workers, initializer=_attach_shared_tt,
+                                            initargs=(self.shared_tt.name,))
+        elif mode == 'split':
+            self.pool = ProcessPoolExecutor(self.workers)
+        else:
+            raise ValueError("unknown parallel search mode: %s" % mode)
+        #start every worker now so process startup isn't taken out of the first search's time budget
+        for future in [self.pool.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.pool.shutdown()
+        if self.shared_tt is not None:
+            self.shared_tt.close()
+            self.shared_tt = None
+
+    #Returns a search.SearchResult. With the same depth and no time budget the split mode always returns the
+    #same move, score and node count whatever the number of workers; ties go to the earliest move in generation
+    #order.
+    def search(self, gs, depth=None, movetime=None, nodes=None):
+        start = time.perf_counter()
+        root_moves = perft.legal_moves(gs)
+        if not root_moves:
+            return search.SearchResult(None, -search.MATE_SCORE if gs.in_check else 0, [], 0, 0, 0.0, [])
+        if self.mode == 'split':
+            #a time or node budget is for the whole root: the root moves are searched one depth at a time, all
+            #against one deadline and one pool of nodes, and only the deepest round every move finished counts,
+            #so moves are never ranked on scores from different depths. Without a budget only the last round runs.
+            depth = depth or 4
+            deadline = time.time() + movetime if movetime else None
+            total_nodes = 0
+            results, best_depth = None, 0
+            for current_depth in range(1 if movetime or nodes else depth, depth + 1):
+                move_nodes = max(1, (nodes - total_nodes) // len(root_moves)) if nodes else None
+                futures = [self.pool.submit(_search_root_move, gs, i, current_depth, move_nodes, self.tt_size_mb,
+                                            deadline)
+                           for i in range(len(root_moves))]
+                round_results = [future.result() for future in futures]
+                total_nodes += sum(r['nodes'] for r in round_results)
+                if min(r['depth'] for r in round_results) < current_depth:
+                    break
+                results, best_depth = round_results, current_depth
+                if (deadline is not None and time.time() >= deadline) or (nodes and total_nodes >= nodes):
+                    break
+            best = sorted(results, key=lambda r: (-r['score'], r['index']))[0]
+        else:
+            self.shared_tt.new_search()
+            futures = [self.pool.submit(_lazy_smp_worker, gs, worker_id, depth, movetime, nodes,
+                                           self.shared_tt.age)
+                       for worker_id in range(self.workers)]
+            results = [future.result() for future in futures]
+            best = sorted(results, key=lambda r: (-r['depth'], r['worker']))[0]
+            best_depth = best['depth']
+            total_nodes = sum(r['nodes'] for r in results)
+        elapsed = time.perf_counter() - start
+        iteration = {'depth': best_depth, 'score': best['score'], 'nodes': total_nodes, 'seconds': elapsed,
+                     'nps': total_nodes / elapsed if elapsed > 0 else 0.0, 'workers': results}
+        pv = moves_from_names(gs, best['pv'])
+        best_move = root_moves[best['index']] if best['index'] >= 0 else root_moves[0]
+        return search.SearchResult(best_move, best['score'], pv, best_depth, total_nodes, elapsed, [iteration])
+
+
+#Times the same search at each worker count. Returns a list of dicts with workers, seconds, nodes, nps,
+#speedup (against the first entry) and the chosen move, so it is easy to see where scaling flattens out.
+def scaling_report(gs, depth=4, worker_counts=(1, 2, 4, 8), mode='split', movetime=None, tt_size_mb=16):
+    report = []
+    for workers in worker_counts:
+        with ParallelSearch(workers, mode, tt_size_mb) as parallel:
+            result = parallel.search(gs, depth=depth, movetime=movetime)
+        entry = {'workers': workers, 'seconds': result.seconds, 'nodes': result.nodes,
+                 'nps': result.nodes / result.seconds if result.seconds else 0.0,
+                 'best_move': perft.move_name(result.best_move) if result.best_move else None,
+                 'score': result.score, 'depth': result.depth}
+        entry['speedup'] = report[0]['seconds'] / entry['seconds'] if report and entry['seconds'] else 1.0
+        report.append(entry)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parallel search across a process pool.")
+    parser.add_argument("--fen", default=perft.START_FEN)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--movetime", type=int, help="time budget per search in milliseconds")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--mode", choices=('split', 'lazysmp'), default='split')
+    parser.add_argument("--hash", type=int, default=16, help="transposition table size in MB")
+    parser.add_argument("--scaling", type=int, nargs='*', metavar='N',
+                        help="print a scaling report for these worker counts (default 1 2 4 8)")
+    args = parser.parse_args(argv)
+    gs = perft.load_fen(args.fen)
+    movetime = args.movetime / 1000 if args.movetime else None
+
+    if args.scaling is not None:
+        print("%8s %10s %12s %12s %8s  %s" % ("workers", "seconds", "nodes", "nodes/s", "speedup", "move"))
+        for entry in scaling_report(gs, args.depth, args.scaling or (1, 2, 4, 8), args.mode, movetime, args.hash):
+            print("%8d %10.2f %12d %12.0f %7.2fx  %s %s" % (entry['workers'], entry['seconds'], entry['nodes'],
+                  entry['nps'], entry['speedup'], entry['best_move'], search.format_score(entry['score'])))
+        return 0
+
+    with ParallelSearch(args.workers, args.mode, args.hash) as parallel:
+        result = parallel.search(gs, depth=args.depth, movetime=movetime)
+    print("bestmove %s score %s depth %d pv %s" % (perft.move_name(result.best_move), search.format_score(result.score),
+          result.depth, " ".join(perft.move_name(move) for move in result.pv)))
+    print("%d nodes in %.2fs (%.0f nodes/s) on %d workers" % (result.nodes, result.seconds,
+          result.nodes / result.seconds if result.seconds else 0.0, args.workers))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
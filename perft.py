@@ -0,0 +1,152 @@
+# Perft (performance test) for move generation.
+# Counts the leaf nodes of the legal move tree to a fixed depth and compares them with known counts,
+# which catches legality bugs, and times the walk, which tracks move generation throughput.
+# Usage:
+#   python perft.py                          run the built-in suite
+#   python perft.py --depth 4                perft of the start position
+#   python perft.py --fen "<fen>" --depth 3 --divide
+#   python perft.py --backend bitboard ...   use bitboard.GameState instead of Engine.GameState
+import argparse
+import sys
+import time
+
+import Engine
+import bitboard
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+#(name, fen, leaf counts for depth 1, 2, 3, ...)
+STANDARD_POSITIONS = [
+    ("start", START_FEN, [20, 400, 8902, 197281, 4865609]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603]),
+    ("pins and en passant", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238, 674624]),
+    ("promotions and castling", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333]),
+    ("promotion with capture", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379, 2103487]),
+    ("middlegame", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594]),
+    ("underpromotions", "n1n5/PPPk4/8/8/8/8/4Kppp/5N1N b - - 0 1", [24, 496, 9483, 182838]),
+    ("illegal en passant (rank pin)", "3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1", [18, 92, 1670, 10138]),
+    ("en passant out of check", "8/8/8/2k5/3Pp3/8/8/4K3 b - d3 0 1", [9, 50, 379]),
+    ("en passant gives check", "8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1", [15, 126, 1928, 13931]),
+    ("castling gives check", "5k2/8/8/8/8/8/8/4K2R w K - 0 1", [15, 66, 1198, 6399]),
+    ("promote out of check", "2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1", [11, 133, 1442, 19174]),
+    ("underpromote to check", "8/P1k5/K7/8/8/8/8/8 w - - 0 1", [6, 27, 273, 1329]),
+    ("castling through attacks", "r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1", [26, 1141, 27826, 1274206]),
+]
+
+BACKENDS = {'engine': Engine.GameState, 'bitboard': bitboard.GameState}
+
+
+#GameState for a FEN string on the chosen backend
+def load_fen(fen, backend='engine'):
+    gs = Engine.GameState.from_fen(fen)
+    if backend == 'bitboard':
+        return bitboard.GameState.from_gamestate(gs)
+    return gs
+
+
+#Legal moves of the position; both backends generate one move per promotion piece, so every move leads
+#to a distinct position
+def legal_moves(gs):
+    return gs.get_valid_moves()
+
+
+#Number of leaf nodes depth plies below the current position
+def perft(gs, depth):
+    if depth == 0:
+        return 1
+    moves = legal_moves(gs)
+    if depth == 1: #bulk count, the moves themselves are the leaves
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.make_move(move)
+        nodes += perft(gs, depth - 1)
+        gs.undo_move()
+    return nodes
+
+
+#Perft split by root move, returns a list of (move name, leaf count)
+def divide(gs, depth):
+    results = []
+    for move in legal_moves(gs):
+        gs.make_move(move)
+        results.append((move_name(move), perft(gs, depth - 1)))
+        gs.undo_move()
+    return results
+
+
+#Coordinate notation (e2e4, e7e8q) used by other engines' divide output, so counts can be diffed line by line
+def move_name(move):
+    name = move.get_rank_file(move.start_row, move.start_col) + move.get_rank_file(move.end_row, move.end_col)
+    if move.pawn_promo and move.promo_piece:
+        name += move.promo_piece.lower()
+    return name
+
+
+#Times a perft run, returns (nodes, seconds, nodes per second)
+def timed_perft(gs, depth):
+    start = time.perf_counter()
+    nodes = perft(gs, depth)
+    elapsed = time.perf_counter() - start
+    return nodes, elapsed, nodes / elapsed if elapsed > 0 else 0.0
+
+
+#Runs every suite position up to max_depth and returns a list of result dicts
+def run_suite(backend='engine', max_depth=3, out=sys.stdout):
+    results = []
+    for name, fen, counts in STANDARD_POSITIONS:
+        for depth in range(1, min(max_depth, len(counts)) + 1):
+            gs = load_fen(fen, backend)
+            nodes, elapsed, nps = timed_perft(gs, depth)
+            passed = nodes == counts[depth - 1]
+            results.append({'name': name, 'depth': depth, 'nodes': nodes, 'expected': counts[depth - 1],
+                            'passed': passed, 'seconds': elapsed, 'nps': nps})
+            if out is not None:
+                print("%-32s depth %d  %10d  %s  %9.0f nodes/s" % (name, depth, nodes,
+                      "ok" if passed else "FAIL (expected %d)" % counts[depth - 1], nps), file=out)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count and time legal move tree leaves.")
+    parser.add_argument("--fen", help="position to search (default: the built-in suite, or the start "
+                                      "position when --depth is given)")
+    parser.add_argument("--depth", type=int, help="perft depth")
+    parser.add_argument("--divide", action="store_true", help="print the leaf count below each root move")
+    parser.add_argument("--suite", action="store_true", help="run the built-in suite of known positions")
+    parser.add_argument("--max-depth", type=int, default=3, help="deepest suite depth to run (default 3)")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default='engine')
+    args = parser.parse_args(argv)
+
+    if args.suite or (args.fen is None and args.depth is None):
+        results = run_suite(args.backend, args.max_depth)
+        failed = [r for r in results if not r['passed']]
+        total_nodes = sum(r['nodes'] for r in results)
+        total_time = sum(r['seconds'] for r in results)
+        print("%d/%d passed, %d nodes in %.2fs (%.0f nodes/s)" % (len(results) - len(failed), len(results),
+              total_nodes, total_time, total_nodes / total_time if total_time else 0.0))
+        return 1 if failed else 0
+
+    gs = load_fen(args.fen or START_FEN, args.backend)
+    depth = args.depth or 1
+    start = time.perf_counter()
+    if args.divide:
+        results = divide(gs, depth)
+        for name, count in results:
+            print("%s: %d" % (name, count))
+        nodes = sum(count for _, count in results)
+        print("\nMoves: %d" % len(results))
+    else:
+        nodes = perft(gs, depth)
+    elapsed = time.perf_counter() - start
+    print("Nodes: %d" % nodes)
+    print("Time: %.3fs (%.0f nodes/s)" % (elapsed, nodes / elapsed if elapsed else 0.0))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
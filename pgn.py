@@ -0,0 +1,128 @@
+# PGN (Portable Game Notation) input and output.
+# Writes games as standard PGN text: the seven tag roster, extra tags, then the SAN moves wrapped to 80 columns.
+# Reads PGN files a game at a time, skipping comments, NAGs and variations, so files of any size stream through
+# in constant memory.
+import re
+import time
+
+import perft
+
+SEVEN_TAGS = ('Event', 'Site', 'Date', 'Round', 'White', 'Black', 'Result')
+LINE_LENGTH = 80
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+
+TAG = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+#a comment in braces, a rest-of-line comment, a NAG, a variation bracket or anything else up to a separator
+MOVETEXT_TOKEN = re.compile(r'\{[^}]*\}?|;[^\n]*|\$\d+|[()]|[^\s(){};]+')
+MOVE_NUMBER = re.compile(r'^\d+\.*')
+
+
+#Tag values are quoted strings, so backslashes and quotes have to be escaped
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+#Movetext for a list of SAN moves: "1. e4 e5 2. Nf3", or "5... Nc6 6. Bb5" when black moves first
+def movetext(sans, result, fullmove=1, white_to_move=True):
+    tokens = []
+    for san in sans:
+        if white_to_move:
+            tokens.append("%d." % fullmove)
+        elif not tokens:
+            tokens.append("%d..." % fullmove)
+        tokens.append(san)
+        if not white_to_move:
+            fullmove += 1
+        white_to_move = not white_to_move
+    tokens.append(result)
+    lines, line = [], ''
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > LINE_LENGTH:
+            lines.append(line)
+            line = token
+        else:
+            line = line + ' ' + token if line else token
+    lines.append(line)
+    return '\n'.join(lines)
+
+
+#Full PGN text of one game. headers is a dict of tags; missing roster tags get the PGN "unknown" values, and
+#a FEN tag (with SetUp) is written when the game didn't start from the standard position.
+def format_game(headers, sans, result, fen=None):
+    tags = {'Event': '?', 'Site': '?', 'Date': time.strftime('%Y.%m.%d'), 'Round': '?', 'White': '?', 'Black': '?'}
+    tags.update(headers)
+    tags['Result'] = result
+    fullmove, white_to_move = 1, True
+    if fen and fen.split()[:4] != perft.START_FEN.split()[:4]:
+        tags['SetUp'] = '1'
+        tags['FEN'] = fen
+        fields = fen.split()
+        white_to_move = len(fields) < 2 or fields[1] == 'w'
+        fullmove = int(fields[5]) if len(fields) > 5 else 1
+    order = list(SEVEN_TAGS) + [tag for tag in tags if tag not in SEVEN_TAGS]
+    lines = ['[%s "%s"]' % (tag, escape(tags[tag])) for tag in order]
+    return '\n'.join(lines) + '\n\n' + movetext(sans, result, fullmove, white_to_move) + '\n\n'
+
+
+#Appends one game to an open file and flushes it, so a game is on disk as soon as it is finished
+def write_game(out, headers, sans, result, fen=None):
+    out.write(format_game(headers, sans, result, fen))
+    out.flush()
+
+
+#Yields (headers, movetext) for each game of a PGN file object, reading it line by line so only the current
+#game is held in memory. The movetext is left unparsed (see parse_movetext), so the caller decides where that
+#work happens.
+def read_games(f):
+    headers, lines = {}, []
+    in_comment = False
+    for line in f:
+        if line.startswith('%'): #escape mechanism, the line is ignored
+            continue
+        stripped = line.strip()
+        if not in_comment and stripped.startswith('['):
+            tag = TAG.match(stripped)
+            if tag:
+                if lines: #tags after movetext start the next game
+                    yield headers, '\n'.join(lines)
+                    headers, lines = {}, []
+                headers[tag.group(1)] = re.sub(r'\\(.)', r'\1', tag.group(2))
+                continue
+        if stripped:
+            lines.append(stripped)
+            in_comment = comment_open(stripped, in_comment)
+    if headers or lines:
+        yield headers, '\n'.join(lines)
+
+
+#Whether a brace comment is still open at the end of line, given whether one was open at its start
+def comment_open(line, in_comment):
+    for char in line:
+        if in_comment:
+            in_comment = char != '}'
+        elif char == '{':
+            in_comment = True
+        elif char == ';':
+            break
+    return in_comment
+
+
+#SAN moves of the main line and the result of a game's movetext. Comments, NAGs, move numbers and
+#variations are dropped; the result is '*' if the movetext doesn't end with one.
+def parse_movetext(text):
+    sans, result = [], '*'
+    depth = 0 #variation nesting
+    for token in MOVETEXT_TOKEN.findall(text):
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth = max(depth - 1, 0)
+        elif depth or token[0] in '{;$':
+            continue
+        elif token in RESULTS:
+            result = token
+        else:
+            token = MOVE_NUMBER.sub('', token) #"12." or "12...", sometimes glued to the move
+            if token:
+                sans.append(token)
+    return sans, result
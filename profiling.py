@@ -0,0 +1,191 @@
+# Opt-in profiling of the GameState hot paths.
+# A Profiler wraps the move generation, attack detection and make/undo methods (and Move construction) with
+# call counters and timers while it is enabled and puts the original functions back afterwards, so Engine.py
+# itself carries no instrumentation and costs nothing when nobody is profiling. Times are kept both inclusive
+# (total) and exclusive (self, minus the time spent in other instrumented functions).
+# The CLI runs a perft or search workload under the counters, or under cProfile with --cprofile.
+# Usage:
+#   python profiling.py perft --depth 3                       counters for the start position
+#   python profiling.py perft --depth 3 --suite               one report per perft suite position
+#   python profiling.py search --depth 4 --fen "<fen>"
+#   python profiling.py search --depth 4 --cprofile out.prof  cProfile report, saved for pstats/snakeviz
+import argparse
+import cProfile
+import functools
+import pstats
+import sys
+import time
+
+import Engine
+import perft
+import search
+
+#(class, method) pairs instrumented by default
+HOT_PATHS = [(Engine.GameState, name) for name in (
+    'get_valid_moves', 'check_pins_and_checks', 'square_under_attack', 'get_attack_map',
+    'get_pawn_moves', 'get_rook_moves', 'get_knight_moves', 'get_bishop_moves', 'get_queen_moves',
+    'get_king_moves', 'get_castle_moves', 'make_move', 'undo_move')] + [(Engine.Move, '__init__')]
+
+#GameState keeps bound per-piece generators in move_funcs, these have to be rebound on instrumented states
+MOVE_FUNCS = {'p': 'get_pawn_moves', 'R': 'get_rook_moves', 'N': 'get_knight_moves',
+              'B': 'get_bishop_moves', 'Q': 'get_queen_moves', 'K': 'get_king_moves'}
+
+
+class Counter():
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0 #inclusive
+        self.self_seconds = 0.0 #exclusive of other instrumented calls
+
+    @property
+    def mean(self):
+        return self.seconds / self.calls if self.calls else 0.0
+
+    @property
+    def rate(self): #calls per second of time spent in the function
+        return self.calls / self.seconds if self.seconds else 0.0
+
+
+class Profiler():
+    #targets is a list of (class, method name) pairs, HOT_PATHS by default. Use as a context manager or call
+    #enable() and disable(); states created before enabling must be passed in so their move_funcs are rebound.
+    def __init__(self, targets=None):
+        self.targets = targets or HOT_PATHS
+        self.stats = {} #"Class.method" -> Counter, in target order
+        for cls, name in self.targets:
+            self.stats[cls.__name__ + '.' + name] = Counter(cls.__name__ + '.' + name)
+        self.originals = {}
+        self.states = []
+        self.stack = [0.0] #time spent in instrumented callees, per active instrumented call
+        self.started = None
+        self.seconds = 0.0 #wall time while enabled
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.disable()
+
+    def enable(self, *states):
+        if self.originals:
+            raise ValueError("profiler is already enabled")
+        for cls, name in self.targets:
+            original = cls.__dict__[name]
+            self.originals[(cls, name)] = original
+            setattr(cls, name, self.wrap(original, self.stats[cls.__name__ + '.' + name]))
+        self.states = list(states)
+        for gs in self.states:
+            rebind(gs)
+        self.started = time.perf_counter()
+        return self
+
+    def disable(self):
+        if not self.originals:
+            return
+        self.seconds += time.perf_counter() - self.started
+        for (cls, name), original in self.originals.items():
+            setattr(cls, name, original)
+        self.originals = {}
+        for gs in self.states:
+            rebind(gs)
+        self.states = []
+
+    def reset(self):
+        for counter in self.stats.values():
+            counter.calls, counter.seconds, counter.self_seconds = 0, 0.0, 0.0
+        self.seconds = 0.0
+        if self.started is not None:
+            self.started = time.perf_counter()
+
+    def wrap(self, function, counter):
+        stack, clock = self.stack, time.perf_counter
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            stack.append(0.0)
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = clock() - start
+                inner = stack.pop()
+                stack[-1] += elapsed
+                counter.calls += 1
+                counter.seconds += elapsed
+                counter.self_seconds += elapsed - inner
+        return timed
+
+    #Counters that were called, busiest (by self time) first
+    def summary(self):
+        return sorted((c for c in self.stats.values() if c.calls), key=lambda c: c.self_seconds, reverse=True)
+
+    #Prints a table of the counters. nodes, if given, adds the workload's nodes per second.
+    def report(self, nodes=None, out=sys.stdout):
+        header = "wall %.3fs" % self.seconds
+        if nodes is not None:
+            header += ", %d nodes, %.0f nodes/s" % (nodes, nodes / self.seconds if self.seconds else 0.0)
+        print(header, file=out)
+        print("%-34s %10s %10s %10s %10s %12s %6s" % ('function', 'calls', 'total ms', 'self ms', 'mean us',
+                                                   'calls/s', 'self%'), file=out)
+        for counter in self.summary():
+            print("%-34s %10d %10.1f %10.1f %10.2f %12.0f %5.1f%%" % (
+                counter.name, counter.calls, counter.seconds * 1000, counter.self_seconds * 1000,
+                counter.mean * 1e6, counter.rate,
+                100 * counter.self_seconds / self.seconds if self.seconds else 0.0), file=out)
+
+
+#Points gs.move_funcs at whatever the GameState class currently has for the piece generators
+def rebind(gs):
+    gs.move_funcs = {piece: getattr(gs, name) for piece, name in MOVE_FUNCS.items()}
+
+
+#Runs the CLI workload on gs, returns the number of nodes it visited
+def run_workload(command, gs, depth):
+    if command == 'perft':
+        return perft.perft(gs, depth)
+    return search.Search().search(gs, depth=depth).nodes
+
+
+#Runs function under cProfile, optionally saves the raw stats to path, and prints the `limit` biggest entries
+#sorted by `sort`. Returns function's result.
+def cprofile_run(function, path=None, sort='cumulative', limit=25, out=sys.stdout):
+    profile = cProfile.Profile()
+    result = profile.runcall(function)
+    if path:
+        profile.dump_stats(path)
+    pstats.Stats(profile, stream=out).strip_dirs().sort_stats(sort).print_stats(limit)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile the GameState hot paths on a perft or search run.")
+    parser.add_argument("command", choices=('perft', 'search'))
+    parser.add_argument("--fen", default=perft.START_FEN)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--suite", action="store_true", help="profile every perft suite position separately")
+    parser.add_argument("--cprofile", nargs='?', const='', metavar="FILE",
+                        help="use cProfile instead of the counters, optionally saving the stats to FILE")
+    parser.add_argument("--sort", default='cumulative', help="pstats sort key for --cprofile (default cumulative)")
+    args = parser.parse_args(argv)
+
+    positions = [(name, fen) for name, fen, _ in perft.STANDARD_POSITIONS] if args.suite else [('', args.fen)]
+    for name, fen in positions:
+        if name:
+            print("== %s" % name)
+        gs = perft.load_fen(fen)
+        if args.cprofile is not None:
+            path = args.cprofile
+            if path and len(positions) > 1:
+                path = "%s.%d" % (path, positions.index((name, fen)))
+            cprofile_run(lambda: run_workload(args.command, gs, args.depth), path, args.sort)
+            continue
+        with Profiler().enable(gs) as profiler:
+            nodes = run_workload(args.command, gs, args.depth)
+        profiler.report(nodes)
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,472 @@
+# Alpha-beta search on top of GameState.
+# Negamax with alpha-beta pruning, iterative deepening under a depth, time or node budget, a fixed-size
+# transposition table and staged move ordering (hash and PV move, winning and even captures, promotions,
+# killers, quiets, losing captures). Leaves are resolved by a capture-only quiescence search that skips
+# captures losing material by static exchange evaluation (SEE).
+# Usage:
+#   python search.py --depth 5
+#   python search.py --fen "<fen>" --movetime 2000
+#   python search.py --nodes 50000 --hash 64
+#   python search.py --fen "<fen>" --depth 4 --verify   raise on any illegal move the search tries
+import argparse
+import sys
+import threading
+import time
+from array import array
+
+import evaluation
+import perft
+
+MAX_PLY = 128
+INFINITY = 1000000
+MATE_SCORE = 100000
+MATE_BOUND = MATE_SCORE - MAX_PLY #scores past this are forced mates
+KNOWN_WIN = 20000 #bitbase win, above any evaluation but below the mate scores
+
+#transposition table bound types
+EXACT, LOWER, UPPER = 0, 1, 2
+
+ORDER_VALUES = {'p': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 20000}
+PROMO_CODES = {None: 0, 'Q': 1, 'R': 2, 'B': 3, 'N': 4}
+
+
+#Material the side making a capture (or promotion) comes out with once every profitable recapture on the
+#target square has been made, both sides taking with their least valuable attacker first (the swap
+#algorithm). Pins are ignored. The exchange is played out on gs.board and put back afterwards.
+def see(gs, move):
+    board = gs.board
+    row, col = move.end_row, move.end_col
+    piece = move.piece_moved[0] + (move.promo_piece or 'Q') if move.pawn_promo else move.piece_moved
+    gains = [ORDER_VALUES[move.captured[1]] if move.captured != '--' else 0]
+    if move.pawn_promo:
+        gains[0] += ORDER_VALUES[piece[1]] - ORDER_VALUES['p']
+    changed = [(move.start_row, move.start_col, board[move.start_row][move.start_col]),
+               (row, col, board[row][col])]
+    if move.enPassant:
+        changed.append((move.start_row, col, board[move.start_row][col]))
+        board[move.start_row][col] = '--'
+    board[move.start_row][move.start_col] = '--'
+    board[row][col] = piece
+    while True:
+        #the side that just captured is the ally, the other side recaptures with its cheapest piece
+        attackers = gs.get_attackers(row, col, piece[0])
+        if not attackers:
+            break
+        gains.append(ORDER_VALUES[piece[1]] - gains[-1]) #what the recapturing side is up if it stops after
+        attacker_row, attacker_col, piece = attackers[0]
+        changed.append((attacker_row, attacker_col, piece))
+        board[attacker_row][attacker_col] = '--'
+        board[row][col] = piece
+    for r, c, original in reversed(changed):
+        board[r][c] = original
+    #each side may stop the exchange, so fold the gains back from the end
+    for i in range(len(gains) - 1, 0, -1):
+        gains[i - 1] = -max(-gains[i - 1], gains[i])
+    return gains[0]
+
+
+#True if the capture can't lose material: the victim is worth at least the attacker, or SEE says so
+def good_capture(gs, move):
+    if ORDER_VALUES[move.captured[1]] >= ORDER_VALUES[move.piece_moved[1]]:
+        return True
+    return see(gs, move) >= 0
+
+
+#Small integer identifying a move within a position (squares and promotion piece), 0 means no move
+def move_key(move):
+    return move.move_ID * 5 + PROMO_CODES[move.promo_piece]
+
+
+#Mate scores are stored relative to the node so they stay correct when reached through a different path
+def score_to_tt(score, ply):
+    if score > MATE_BOUND:
+        return score + ply
+    if score < -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def score_from_tt(score, ply):
+    if score > MATE_BOUND:
+        return score - ply
+    if score < -MATE_BOUND:
+        return score + ply
+    return score
+
+
+class TranspositionTable():
+    #key, move, score, depth, flag and age
+    ENTRY_BYTES = 8 + 2 + 4 + 1 + 1 + 1
+
+    #Fixed number of slots (a power of two fitting in size_mb), stored in flat typed arrays so memory use
+    #is allocated once up front and never grows
+    def __init__(self, size_mb=16):
+        entries = max(1, size_mb * 1024 * 1024 // self.ENTRY_BYTES)
+        self.size = 1 << (entries.bit_length() - 1)
+        self.mask = self.size - 1
+        self.keys = array('Q', bytes(8 * self.size))
+        self.moves = array('H', bytes(2 * self.size))
+        self.scores = array('i', bytes(4 * self.size))
+        self.depths = array('b', [-1]) * self.size #-1 marks an empty slot
+        self.flags = array('B', bytes(self.size))
+        self.ages = array('B', bytes(self.size))
+        self.age = 0
+
+    #Entries from earlier searches become replaceable regardless of depth
+    def new_search(self):
+        self.age = (self.age + 1) & 0xFF
+
+    def clear(self):
+        for i in range(self.size):
+            self.depths[i] = -1
+        self.age = 0
+
+    #Returns (depth, score, flag, move key) or None
+    def probe(self, key):
+        i = key & self.mask
+        if self.keys[i] == key and self.depths[i] >= 0:
+            return self.depths[i], self.scores[i], self.flags[i], self.moves[i]
+        return None
+
+    #Depth-preferred replacement: a deeper entry from the current search is only overwritten by the
+    #same position, everything else is always replaced
+    def store(self, key, depth, score, flag, move):
+        i = key & self.mask
+        if self.keys[i] != key and self.ages[i] == self.age and self.depths[i] > depth:
+            return
+        if move == 0 and self.keys[i] == key:
+            move = self.moves[i] #keep the old best move rather than losing it
+        self.keys[i] = key
+        self.moves[i] = move
+        self.scores[i] = score
+        self.depths[i] = min(depth, 127)
+        self.flags[i] = flag
+        self.ages[i] = self.age
+
+    #Permille of the first 1000 slots in use by the current search (UCI "hashfull")
+    def hashfull(self):
+        sample = min(1000, self.size)
+        used = sum(1 for i in range(sample) if self.depths[i] >= 0 and self.ages[i] == self.age)
+        return used * 1000 // sample
+
+
+class SearchAborted(Exception):
+    pass
+
+
+class SearchResult():
+    def __init__(self, best_move, score, pv, depth, nodes, seconds, iterations):
+        self.best_move = best_move
+        self.score = score
+        self.pv = pv
+        self.depth = depth
+        self.nodes = nodes
+        self.seconds = seconds
+        self.iterations = iterations #one dict per completed depth, see Search.search
+
+
+class Search():
+    #tt can be any object with the TranspositionTable interface (e.g. a table shared between processes),
+    #bitbases a bitbases.Bitbases to score positions it covers without searching them
+    def __init__(self, tt_size_mb=16, evaluate=evaluation.evaluate, tt=None, bitbases=None, quiescence=True):
+        self.tt = tt if tt is not None else TranspositionTable(tt_size_mb)
+        self.evaluate = evaluate
+        self.bitbases = bitbases
+        self.quiescence_enabled = quiescence #False scores the horizon with the static evaluation only
+        self.probe_bitbases = False
+        self.verify_moves = False #check every move the search tries against the full legal move list (slow)
+        self.stop_event = threading.Event() #set from another thread to end the search early
+        self.nodes = 0
+        self.deadline = None
+        self.node_limit = None
+        self.pv_line = []
+        self.pv_table = []
+        self.killers = []
+
+    def stop(self):
+        self.stop_event.set()
+
+    #Iterative deepening. Stops after `depth` plies, `movetime` seconds, `nodes` nodes or stop(),
+    #whichever comes first, and returns the result of the deepest completed iteration. `info` is called
+    #with each iteration's dict: depth, score, nodes, seconds, nps, pv.
+    def search(self, gs, depth=None, movetime=None, nodes=None, info=None):
+        max_depth = min(depth or MAX_PLY - 1, MAX_PLY - 1)
+        start = time.perf_counter()
+        self.deadline = start + movetime if movetime else None
+        self.node_limit = nodes
+        self.nodes = 0
+        self.stop_event.clear()
+        self.tt.new_search()
+        self.pv_line = []
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        root_ply = len(gs.move_log)
+        #inside a bitbase ending every move would get the same score, so only probe positions the search
+        #converts into one
+        self.probe_bitbases = self.bitbases is not None and self.bitbases.probe(gs) is None
+
+        root_moves = perft.legal_moves(gs)
+        result = SearchResult(root_moves[0] if root_moves else None, 0, [], 0, 0, 0.0, [])
+        if not root_moves:
+            result.score = -MATE_SCORE if gs.in_check else 0
+            return result
+
+        for current_depth in range(1, max_depth + 1):
+            iteration_start = time.perf_counter()
+            iteration_nodes = self.nodes
+            self.pv_table = [[] for _ in range(MAX_PLY + 1)]
+            try:
+                score = self.negamax(gs, current_depth, -INFINITY, INFINITY, 0)
+            except SearchAborted:
+                while len(gs.move_log) > root_ply:
+                    gs.undo_move()
+                break
+            now = time.perf_counter()
+            self.pv_line = self.pv_table[0]
+            iteration = {'depth': current_depth, 'score': score, 'nodes': self.nodes - iteration_nodes,
+                         'seconds': now - iteration_start, 'pv': list(self.pv_line)}
+            iteration['nps'] = iteration['nodes'] / iteration['seconds'] if iteration['seconds'] > 0 else 0.0
+            result.iterations.append(iteration)
+            if self.pv_line:
+                result.best_move = self.pv_line[0]
+            result.score, result.pv, result.depth = score, list(self.pv_line), current_depth
+            if info is not None:
+                info(iteration)
+            if abs(score) > MATE_BOUND and MATE_SCORE - abs(score) <= current_depth:
+                break #forced mate found inside the full-width horizon, deeper won't change it
+            if self.deadline is not None and now >= self.deadline:
+                break
+
+        result.nodes = self.nodes
+        result.seconds = time.perf_counter() - start
+        return result
+
+    def check_limits(self):
+        if self.stop_event.is_set():
+            raise SearchAborted()
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchAborted()
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchAborted()
+
+    def negamax(self, gs, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.check_limits()
+        self.pv_table[ply] = []
+        if ply > 0 and (gs.is_fifty_move_rule() or gs.is_repetition(2)):
+            return 0
+        if self.probe_bitbases and ply > 0:
+            result = self.bitbases.probe(gs)
+            if result is not None:
+                return result * (KNOWN_WIN - ply)
+
+        alpha_orig = alpha
+        key = gs.zobrist_key
+        hash_move = 0
+        entry = self.tt.probe(key)
+        if entry is not None:
+            entry_depth, entry_score, entry_flag, hash_move = entry
+            if ply > 0 and entry_depth >= depth:
+                entry_score = score_from_tt(entry_score, ply)
+                if entry_flag == EXACT:
+                    return entry_score
+                if entry_flag == LOWER and entry_score >= beta:
+                    return entry_score
+                if entry_flag == UPPER and entry_score <= alpha:
+                    return entry_score
+
+        if depth <= 0 or ply >= MAX_PLY:
+            if self.quiescence_enabled and ply < MAX_PLY:
+                return self.quiescence(gs, alpha, beta, ply)
+            return self.evaluate(gs)
+
+        gs.prepare_moves()
+        in_check = gs.in_check #gs.in_check gets overwritten by the child nodes
+        best_score = -INFINITY
+        best_move = None
+        moves = self.staged_moves(gs, hash_move, ply)
+        if self.verify_moves:
+            moves = checked_moves(gs, moves)
+        for move in moves:
+            gs.make_move(move)
+            score = -self.negamax(gs, depth - 1, -beta, -alpha, ply + 1)
+            gs.undo_move()
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    self.pv_table[ply] = [move] + self.pv_table[ply + 1]
+                    if alpha >= beta:
+                        if move.captured == '--' and not move.pawn_promo:
+                            self.store_killer(move, ply)
+                        break
+        if best_move is None:
+            return -MATE_SCORE + ply if in_check else 0
+
+        if best_score <= alpha_orig:
+            flag = UPPER
+        elif best_score >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.tt.store(key, depth, score_to_tt(best_score, ply), flag, move_key(best_move))
+        return best_score
+
+    #Captures-only search below the horizon, so leaves aren't scored in the middle of an exchange. The side to
+    #move can stand pat on the static evaluation or try a capture (or queen promotion) that doesn't lose
+    #material by SEE. In check there is no standing pat and every evasion is searched.
+    def quiescence(self, gs, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.check_limits()
+        self.pv_table[ply] = []
+        if ply >= MAX_PLY:
+            return self.evaluate(gs)
+        gs.prepare_moves()
+        if gs.in_check:
+            moves = gs.get_valid_moves()
+            if not moves:
+                return -MATE_SCORE + ply
+            best_score = -INFINITY
+        else: #stalemates aren't detected here, the static evaluation is close enough at the leaves
+            best_score = self.evaluate(gs)
+            if best_score >= beta:
+                return best_score
+            alpha = max(alpha, best_score)
+            #not in check, so the pin-aware generators already produce only legal moves
+            moves = [move for move in gs.get_all_possible() if (move.captured != '--' and good_capture(gs, move))
+                     or (move.pawn_promo and move.promo_piece == 'Q')]
+            moves.sort(key=lambda move: 10 * ORDER_VALUES[move.captured[1]] - ORDER_VALUES[move.piece_moved[1]]
+                       if move.captured != '--' else 0, reverse=True)
+        for move in moves:
+            gs.make_move(move)
+            score = -self.quiescence(gs, -beta, -alpha, ply + 1)
+            gs.undo_move()
+            if score > best_score:
+                best_score = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return best_score
+
+    #Quiet moves that caused a beta cutoff at this ply, tried early in sibling positions
+    def store_killer(self, move, ply):
+        key = move_key(move)
+        killers = self.killers[ply]
+        if killers[0] != key:
+            killers[1] = killers[0]
+            killers[0] = key
+
+    #Legal move for a move key, generating only the moves of the piece on its start square (None if there is
+    #no such move, e.g. a hash collision). gs must be prepared (GameState.prepare_moves).
+    def find_move(self, gs, key):
+        move_id = key // 5
+        for move in gs.get_piece_moves(move_id // 1000, move_id // 100 % 10):
+            if move_key(move) == key:
+                return move
+        return None
+
+    #Yields the moves of the position in stages: the hash move and the previous iteration's PV move (both found
+    #before either is searched, without generating anything else), then captures that don't lose material by
+    #SEE in most valuable victim / least valuable attacker order, promotions, killer moves, the remaining quiet
+    #moves and finally the losing captures. The later stages share one full generation that only runs if the
+    #hash and PV moves didn't cut off. gs must be prepared (GameState.prepare_moves).
+    def staged_moves(self, gs, hash_move, ply):
+        tried = set()
+        first = []
+        pv_move = move_key(self.pv_line[ply]) if ply < len(self.pv_line) else 0
+        for key in (hash_move, pv_move):
+            if key and key not in tried:
+                move = self.find_move(gs, key) #the pin and check state is only valid until a child search
+                if move is not None:
+                    tried.add(key)
+                    first.append(move)
+        yield from first
+
+        #the child searches changed gs's check and pin state, so this regenerates from scratch; the
+        #GameState move functions produce captures and quiet moves together, so quiets are kept for later
+        captures, promotions, quiets, losing = [], [], [], []
+        for move in gs.get_valid_moves():
+            if move_key(move) in tried:
+                continue
+            if move.captured != '--':
+                if good_capture(gs, move):
+                    captures.append(move)
+                else:
+                    losing.append(move)
+            elif move.pawn_promo:
+                promotions.append(move)
+            else:
+                quiets.append(move)
+        captures.sort(key=lambda move: (10 * ORDER_VALUES[move.captured[1]] - ORDER_VALUES[move.piece_moved[1]]
+                                        + (ORDER_VALUES[move.promo_piece] if move.pawn_promo else 0)),
+                      reverse=True)
+        yield from captures
+        if promotions:
+            promotions.sort(key=lambda move: ORDER_VALUES[move.promo_piece], reverse=True)
+            yield from promotions
+
+        killers = [key for key in self.killers[ply] if key and key not in tried]
+        if killers:
+            rest = []
+            for move in quiets:
+                if move_key(move) in killers:
+                    yield move
+                else:
+                    rest.append(move)
+            quiets = rest
+        yield from quiets
+        yield from losing
+
+
+#Passes moves through, raising ValueError for any that isn't in gs's legal move list. The list is generated
+#before the first move is taken from moves, so gs must be in the position they are for.
+def checked_moves(gs, moves):
+    legal = set(gs.get_valid_moves())
+    gs.prepare_moves()
+    for move in moves:
+        if move not in legal:
+            raise ValueError("illegal move %s generated in %s" % (perft.move_name(move), gs.to_fen()))
+        yield move
+
+
+def format_score(score):
+    if score > MATE_BOUND:
+        return "mate %d" % ((MATE_SCORE - score + 1) // 2)
+    if score < -MATE_BOUND:
+        return "mate -%d" % ((MATE_SCORE + score) // 2)
+    return "cp %d" % score
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search a position and print each iteration.")
+    parser.add_argument("--fen", default=perft.START_FEN)
+    parser.add_argument("--depth", type=int, help="maximum depth in plies")
+    parser.add_argument("--movetime", type=int, help="time budget in milliseconds")
+    parser.add_argument("--nodes", type=int, help="node budget")
+    parser.add_argument("--hash", type=int, default=16, help="transposition table size in MB (default 16)")
+    parser.add_argument("--verify", action="store_true", help="check every move searched is legal (slow)")
+    args = parser.parse_args(argv)
+    if args.depth is None and args.movetime is None and args.nodes is None:
+        args.depth = 4
+
+    def report(iteration):
+        print("depth %d score %s nodes %d time %.2fs nps %.0f pv %s" % (
+            iteration['depth'], format_score(iteration['score']), iteration['nodes'], iteration['seconds'],
+            iteration['nps'], " ".join(perft.move_name(move) for move in iteration['pv'])))
+
+    gs = perft.load_fen(args.fen)
+    searcher = Search(args.hash)
+    searcher.verify_moves = args.verify
+    result = searcher.search(gs, depth=args.depth, movetime=args.movetime / 1000 if args.movetime else None,
+                             nodes=args.nodes, info=report)
+    print("bestmove %s (%d nodes in %.2fs, %.0f nodes/s)" % (
+        perft.move_name(result.best_move) if result.best_move else "(none)", result.nodes, result.seconds,
+        result.nodes / result.seconds if result.seconds else 0.0))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+# Self-play / engine-vs-engine matches.
+# Plays games on a process pool from a list of opening positions (each opening twice, colors swapped), with
+# GameState enforcing the rules and adjudicating mate, stalemate, threefold repetition, the 50-move rule and
+# insufficient material. Every game is appended to the PGN file as soon as it finishes. With --book both engines
+# play from a Polyglot opening book while it has moves for the position.
+# Engines are given as comma separated search limits, e.g. "depth=3" or "movetime=200,hash=32".
+# Usage:
+#   python selfplay.py --games 40 --workers 4 --engine1 depth=3 --engine2 depth=2 --pgn match.pgn
+#   python selfplay.py --openings openings.epd --games 100 --engine1 movetime=100 --engine2 movetime=100
+import argparse
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import Engine
+import epd
+import perft
+import pgn
+import polyglot
+import search
+
+#a few common openings, a handful of plies in, so games don't all start the same way
+OPENINGS = [
+    perft.START_FEN,
+    "rnbqkbnr/pppp1ppp/8/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R b KQkq - 1 2", #1. e4 e5 2. Nf3
+    "rnbqkbnr/pp1ppppp/8/2p5/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2", #1. e4 c5
+    "rnbqkbnr/pppp1ppp/4p3/8/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2", #1. e4 e6
+    "rnbqkbnr/ppp1pppp/8/3p4/2PP4/8/PP2PPPP/RNBQKBNR b KQkq - 0 2", #1. d4 d5 2. c4
+    "rnbqkb1r/pppppppp/5n2/8/3P4/8/PPP1PPPP/RNBQKBNR w KQkq - 1 2", #1. d4 Nf6
+    "rnbqkbnr/pppppppp/8/8/2P5/8/PP1PPPPP/RNBQKBNR b KQkq - 0 1", #1. c4
+    "rnbqkbnr/pppppppp/8/8/8/5N2/PPPPPPPP/RNBQKB1R b KQkq - 1 1", #1. Nf3
+]
+
+ENGINE_OPTIONS = ('depth', 'movetime', 'nodes', 'hash')
+
+
+#Parses "depth=3,hash=32" into a dict; movetime is given in milliseconds
+def parse_engine(text):
+    options = {}
+    for item in text.split(','):
+        name, _, value = item.partition('=')
+        name = name.strip()
+        if name not in ENGINE_OPTIONS or not value.strip().isdigit():
+            raise ValueError("invalid engine option: %s" % item)
+        options[name] = int(value)
+    return options
+
+
+#Opening FENs from an EPD or FEN-per-line file
+def read_openings(path):
+    return [epd.parse_epd(line)[0] for _, line in epd.read_epd(path)]
+
+
+#True if neither side has enough material left to mate: bare kings, or a single minor piece against a bare king
+def insufficient_material(board):
+    others = [piece[1] for row in board for piece in row if piece != '--' and piece[1] != 'K']
+    return len(others) == 0 or (len(others) == 1 and others[0] in 'NB')
+
+
+_books = {} #open books of this worker process by path, mapped once and reused for every game
+
+
+def open_book(path):
+    if path not in _books:
+        _books[path] = polyglot.OpeningBook(path)
+    return _books[path]
+
+
+#Plays one game and returns a dict describing it; runs in a worker process. engines is (white, black), each a
+#(name, options) pair.
+def play_game(task):
+    number, fen, engines, max_plies, book_path = task
+    book = open_book(book_path) if book_path else None
+    gs = Engine.GameState.from_fen(fen)
+    searchers = [search.Search(options.get('hash', 16)) for _, options in engines]
+    nodes, seconds = [0, 0], [0.0, 0.0]
+    sans = []
+    result, termination = '*', ''
+    while True:
+        if not gs.has_legal_move():
+            if gs.in_check:
+                result, termination = ('0-1' if gs.white_to_move else '1-0'), 'checkmate'
+            else:
+                result, termination = '1/2-1/2', 'stalemate'
+        elif gs.is_repetition(3):
+            result, termination = '1/2-1/2', 'threefold repetition'
+        elif gs.is_fifty_move_rule():
+            result, termination = '1/2-1/2', 'fifty-move rule'
+        elif insufficient_material(gs.board):
+            result, termination = '1/2-1/2', 'insufficient material'
+        elif len(sans) >= max_plies:
+            result, termination = '1/2-1/2', 'move limit'
+        if termination:
+            break
+        side = 0 if gs.white_to_move else 1
+        options = engines[side][1]
+        move = book.choose_move(gs) if book is not None else None
+        if move is None:
+            book = None #out of book for good
+            found = searchers[side].search(gs, depth=options.get('depth'), nodes=options.get('nodes'),
+                                           movetime=options['movetime'] / 1000 if 'movetime' in options else None)
+            nodes[side] += found.nodes
+            seconds[side] += found.seconds
+            move = found.best_move
+        sans.append(gs.get_san(move))
+        gs.make_move(move)
+    return {'number': number, 'fen': fen, 'white': engines[0][0], 'black': engines[1][0], 'result': result,
+            'termination': termination, 'sans': sans, 'nodes': nodes, 'seconds': seconds,
+            'nps': [nodes[i] / seconds[i] if seconds[i] else 0.0 for i in range(2)]}
+
+
+#Elo difference implied by a match score, with the half-width of its 95% confidence interval (from the
+#spread of the per-game scores). Returns (elo, margin); both are infinite when one side won everything.
+def elo_difference(wins, draws, losses):
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0, math.inf
+    score = (wins + draws / 2) / games
+    if score <= 0 or score >= 1:
+        return (math.inf if score >= 1 else -math.inf), math.inf
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    deviation = math.sqrt(variance / games)
+
+    def to_elo(s):
+        s = min(max(s, 1e-9), 1 - 1e-9)
+        return 400 * math.log10(s / (1 - s))
+
+    margin = (to_elo(score + 1.96 * deviation) - to_elo(score - 1.96 * deviation)) / 2
+    return to_elo(score), margin
+
+
+#Plays `games` games between two engines (dicts of search limits) and appends each finished game to the
+#PGN file object out. Each opening is played twice with the colors swapped. progress, if given, is called
+#with each game's result dict. Returns a summary dict from engine1's point of view.
+def run_match(engine1, engine2, games, openings=None, workers=None, out=None, max_plies=300, progress=None,
+              names=('engine1', 'engine2'), book=None):
+    openings = openings or OPENINGS
+    workers = workers or os.cpu_count() or 1
+    players = [(names[0], engine1), (names[1], engine2)]
+    tasks = []
+    for number in range(games):
+        fen = openings[(number // 2) % len(openings)]
+        white, black = (players[0], players[1]) if number % 2 == 0 else (players[1], players[0])
+        tasks.append((number + 1, fen, (white, black), max_plies, book))
+
+    summary = {'games': 0, 'wins': 0, 'draws': 0, 'losses': 0, 'nodes': 0, 'search_seconds': 0.0,
+               'terminations': {}}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(play_game, task) for task in tasks]
+        for future in as_completed(futures):
+            game = future.result()
+            if out is not None:
+                pgn.write_game(out, {'Event': 'selfplay', 'Round': game['number'],
+                                     'White': game['white'], 'Black': game['black'],
+                                     'Termination': game['termination'], 'PlyCount': len(game['sans'])},
+                               game['sans'], game['result'], game['fen'])
+            summary['games'] += 1
+            summary['nodes'] += sum(game['nodes'])
+            summary['search_seconds'] += sum(game['seconds'])
+            summary['terminations'][game['termination']] = summary['terminations'].get(game['termination'], 0) + 1
+            if game['result'] == '1/2-1/2':
+                summary['draws'] += 1
+            elif (game['result'] == '1-0') == (game['white'] == names[0]):
+                summary['wins'] += 1
+            else:
+                summary['losses'] += 1
+            if progress is not None:
+                progress(game)
+    summary['seconds'] = time.perf_counter() - start
+    summary['games_per_hour'] = summary['games'] * 3600 / summary['seconds'] if summary['seconds'] else 0.0
+    summary['nps'] = summary['nodes'] / summary['search_seconds'] if summary['search_seconds'] else 0.0
+    summary['elo'], summary['elo_margin'] = elo_difference(summary['wins'], summary['draws'], summary['losses'])
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play a self-play match on a process pool.")
+    parser.add_argument("--games", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--engine1", default="depth=3", help="search limits, e.g. depth=3 or movetime=200,hash=32")
+    parser.add_argument("--engine2", default="depth=3")
+    parser.add_argument("--openings", help="EPD/FEN file of starting positions (default: built-in list)")
+    parser.add_argument("--pgn", help="PGN file to append finished games to")
+    parser.add_argument("--book", help="Polyglot opening book both engines play from")
+    parser.add_argument("--max-plies", type=int, default=300, help="adjudicate a draw after this many plies")
+    args = parser.parse_args(argv)
+    openings = read_openings(args.openings) if args.openings else None
+
+    def report(game):
+        print("game %d: %s - %s %s (%s, %d plies, %.0f / %.0f nodes/s)" % (
+            game['number'], game['white'], game['black'], game['result'], game['termination'], len(game['sans']),
+            game['nps'][0], game['nps'][1]))
+
+    out = open(args.pgn, 'a') if args.pgn else None
+    try:
+        summary = run_match(parse_engine(args.engine1), parse_engine(args.engine2), args.games, openings,
+                            args.workers, out, args.max_plies, report, book=args.book)
+    finally:
+        if out is not None:
+            out.close()
+    print("engine1 vs engine2: +%d =%d -%d, Elo %+.0f +/- %.0f" % (summary['wins'], summary['draws'],
+          summary['losses'], summary['elo'], summary['elo_margin']))
+    print("%d games in %.1fs (%.0f games/hour), %.0f nodes/s" % (summary['games'], summary['seconds'],
+          summary['games_per_hour'], summary['nps']))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
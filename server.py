@@ -0,0 +1,455 @@
+# Local analysis server.
+# Hosts many games at once over HTTP/JSON, each a GameState session (with a small legal move cache) kept in
+# memory, and sends searches to a bounded pool of warm worker processes that keep their hash tables between
+# requests. Every search gets a time budget capped by the server, the number of searches waiting for a worker
+# is bounded (503 when full), each session is limited to --max-plies moves and sessions idle for --idle-timeout
+# seconds are dropped.
+# Endpoints (JSON in and out, moves in UCI (e2e4) or SAN):
+#   POST   /session                  {"fen": optional}             new session
+#   GET    /session/<id>                                           position, status and legal moves
+#   POST   /session/<id>/move        {"move": "e2e4"}
+#   POST   /session/<id>/undo
+#   POST   /session/<id>/analyze     {"depth": n, "movetime": ms}  search the session's position
+#   DELETE /session/<id>
+#   POST   /analyze                  {"positions": [fen, ...], "depth": n, "movetime": ms}
+#   GET    /stats
+# Usage:
+#   python server.py serve --port 8765 --workers 4
+#   python server.py load --url http://127.0.0.1:8765 --clients 50 --requests 40   load generator
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import Engine
+import analyze
+import perft
+import search
+
+DEFAULT_PORT = 8765
+MAX_BODY = 1 << 20 #bytes
+MAX_BATCH = 256 #positions per /analyze request
+LISTEN_BACKLOG = 512 #connections waiting to be accepted, the socketserver default of 5 resets bursts of clients
+GRACE = 2.0 #seconds a search may overrun its budget (pickling, a busy worker) before the request fails
+
+
+class ServerError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+_searcher = None #the worker process's Search, created by init_worker so its hash table is allocated once
+
+
+def init_worker(hash_mb):
+    global _searcher
+    _searcher = search.Search(hash_mb)
+
+
+#Searches one position; runs in a worker process
+def analyze_position(fen, depth, movetime):
+    gs = Engine.GameState.from_fen(fen)
+    result = _searcher.search(gs, depth=depth, movetime=movetime)
+    if result.best_move is None:
+        return {'fen': fen, 'bestmove': None, 'san': None, 'score': search.format_score(result.score),
+                'depth': 0, 'nodes': 0, 'pv': []}
+    return {'fen': fen, 'bestmove': perft.move_name(result.best_move), 'san': gs.get_san(result.best_move),
+            'score': search.format_score(result.score), 'depth': result.depth, 'nodes': result.nodes,
+            'pv': [perft.move_name(move) for move in result.pv]}
+
+
+class Session():
+    def __init__(self, gs, cache_size):
+        self.gs = gs
+        self.gs.move_cache = Engine.MoveCache(cache_size)
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+
+class AnalysisService():
+    #Sessions and the worker pool, independent of HTTP. Methods raise ServerError with an HTTP status.
+    def __init__(self, workers=None, hash_mb=16, max_sessions=1000, max_plies=1000, idle_timeout=600,
+                 max_movetime=5.0, max_depth=8, max_pending=None, cache_size=256):
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = ProcessPoolExecutor(self.workers, initializer=init_worker, initargs=(hash_mb,))
+        #start every worker now so the first requests don't pay for process startup and table allocation
+        for future in [self.pool.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+        self.pending = threading.BoundedSemaphore(max_pending or self.workers * 8)
+        self.queued_seconds = 0.0 #time budgets of the searches submitted and not finished yet
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.max_sessions = max_sessions
+        self.max_plies = max_plies
+        self.idle_timeout = idle_timeout
+        self.max_movetime = max_movetime
+        self.max_depth = max_depth
+        self.cache_size = cache_size
+        self.counters = {'requests': 0, 'searches': 0, 'timeouts': 0, 'rejected': 0, 'evicted': 0}
+        self.closed = threading.Event()
+        self.sweeper = threading.Thread(target=self.sweep, daemon=True)
+        self.sweeper.start()
+
+    def close(self):
+        self.closed.set()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    #Drops sessions nobody has used for idle_timeout seconds
+    def sweep(self):
+        while not self.closed.wait(min(self.idle_timeout / 4, 30)):
+            cutoff = time.monotonic() - self.idle_timeout
+            with self.lock:
+                idle = [key for key, session in self.sessions.items() if session.last_used < cutoff]
+                for key in idle:
+                    del self.sessions[key]
+                self.counters['evicted'] += len(idle)
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def create_session(self, fen=None):
+        try:
+            gs = Engine.GameState.from_fen(fen) if fen else Engine.GameState()
+        except ValueError as error:
+            raise ServerError(400, str(error))
+        with self.lock:
+            if len(self.sessions) >= self.max_sessions:
+                raise ServerError(503, "too many sessions")
+            key = uuid.uuid4().hex
+            self.sessions[key] = Session(gs, self.cache_size)
+        return key
+
+    def get_session(self, key):
+        with self.lock:
+            session = self.sessions.get(key)
+        if session is None:
+            raise ServerError(404, "no such session: %s" % key)
+        session.last_used = time.monotonic()
+        return session
+
+    def delete_session(self, key):
+        with self.lock:
+            if self.sessions.pop(key, None) is None:
+                raise ServerError(404, "no such session: %s" % key)
+
+    #Position, legal moves and status of a session
+    def state(self, key):
+        session = self.get_session(key)
+        with session.lock:
+            return self.describe(key, session.gs)
+
+    def describe(self, key, gs):
+        moves = gs.get_valid_moves()
+        return {'id': key, 'fen': gs.to_fen(), 'turn': 'w' if gs.white_to_move else 'b', 'in_check': gs.in_check,
+                'status': analyze.termination(gs) or 'playing', 'plies': len(gs.move_log),
+                'moves': [perft.move_name(move) for move in moves]}
+
+    def make_move(self, key, name):
+        session = self.get_session(key)
+        with session.lock:
+            gs = session.gs
+            if len(gs.move_log) >= self.max_plies:
+                raise ServerError(409, "session is at its limit of %d plies" % self.max_plies)
+            match = [move for move in gs.get_valid_moves() if perft.move_name(move) == name]
+            try:
+                move = match[0] if match else gs.parse_san(str(name))
+            except ValueError as error:
+                raise ServerError(400, str(error))
+            gs.make_move(move)
+            return self.describe(key, gs)
+
+    def undo_move(self, key):
+        session = self.get_session(key)
+        with session.lock:
+            if not session.gs.move_log:
+                raise ServerError(409, "nothing to undo")
+            session.gs.undo_move()
+            return self.describe(key, session.gs)
+
+    def analyze_session(self, key, depth=None, movetime=None):
+        session = self.get_session(key)
+        with session.lock:
+            fen = session.gs.to_fen()
+        return self.analyze_positions([fen], depth, movetime)[0]
+
+    #Searches each FEN on the pool, all within one time budget that also covers the searches already queued
+    #ahead of them. The limits are capped by the server's. A position the worker fails on gets an error entry.
+    def analyze_positions(self, fens, depth=None, movetime=None):
+        if not isinstance(fens, list) or not fens or len(fens) > MAX_BATCH:
+            raise ServerError(400, "positions must be a list of 1 to %d FENs" % MAX_BATCH)
+        for i, fen in enumerate(fens):
+            if not isinstance(fen, str):
+                raise ServerError(400, "position %d is not a FEN string" % i)
+            try:
+                Engine.GameState.from_fen(fen)
+            except ValueError as error:
+                raise ServerError(400, "position %d: %s" % (i, error))
+        depth, movetime = self.limits(depth, movetime)
+        acquired = 0
+        futures = []
+        try:
+            for _ in fens:
+                if not self.pending.acquire(blocking=False):
+                    self.count('rejected')
+                    raise ServerError(503, "all workers are busy")
+                acquired += 1
+            with self.lock:
+                queued = self.queued_seconds
+            #a slot stays taken until its search is over, even if this request gave up on it
+            for fen in fens:
+                with self.lock:
+                    self.queued_seconds += movetime
+                future = self.pool.submit(analyze_position, fen, depth, movetime)
+                future.add_done_callback(lambda f: self.finished(movetime))
+                futures.append(future)
+                acquired -= 1
+            #the searches ahead of these share the workers, then these run workers at a time, each within movetime
+            deadline = (time.monotonic() + queued / self.workers + movetime * -(-len(fens) // self.workers)
+                        + GRACE)
+            results = []
+            for fen, future in zip(fens, futures):
+                try:
+                    results.append(future.result(timeout=max(deadline - time.monotonic(), 0)))
+                except TimeoutError:
+                    self.count('timeouts')
+                    for other in futures:
+                        other.cancel()
+                    raise ServerError(504, "analysis took longer than its time budget")
+                except Exception as error:
+                    results.append({'fen': fen, 'error': "%s: %s" % (type(error).__name__, error)})
+            with self.lock:
+                self.counters['searches'] += len(fens)
+            return results
+        finally:
+            for _ in range(acquired):
+                self.pending.release()
+
+    #Done callback of a search: frees its slot and takes its budget off the queue
+    def finished(self, movetime):
+        with self.lock:
+            self.queued_seconds -= movetime
+        self.pending.release()
+
+    #(depth, movetime in seconds) for a request; every search gets a time budget, the server's by default
+    def limits(self, depth, movetime):
+        try:
+            depth = min(int(depth), self.max_depth) if depth is not None else self.max_depth
+            movetime = min(int(movetime) / 1000, self.max_movetime) if movetime is not None else self.max_movetime
+        except (TypeError, ValueError):
+            raise ServerError(400, "depth and movetime must be integers")
+        return max(depth, 1), max(movetime, 0.01)
+
+    def stats(self):
+        with self.lock:
+            caches = [session.gs.move_cache.stats() for session in self.sessions.values()]
+            result = dict(self.counters, sessions=len(self.sessions), workers=self.workers)
+        hits, misses = sum(c['hits'] for c in caches), sum(c['misses'] for c in caches)
+        result['move_cache_hit_rate'] = hits / (hits + misses) if hits + misses else 0.0
+        return result
+
+
+SESSION_PATH = re.compile(r'^/session/([0-9a-f]+)(?:/(move|undo|analyze))?$')
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    service = None #set by make_server
+    protocol_version = 'HTTP/1.1' #keep-alive, so load generators don't reconnect for every request
+
+    def log_message(self, format, *args):
+        pass #one line per request would dominate the time at hundreds of requests per second
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def dispatch(self, method):
+        service = self.service
+        service.count('requests')
+        try:
+            body = self.read_body()
+            path = self.path.split('?', 1)[0]
+            match = SESSION_PATH.match(path)
+            if path == '/session' and method == 'POST':
+                key = service.create_session(body.get('fen'))
+                self.reply(201, service.state(key))
+            elif path == '/analyze' and method == 'POST':
+                self.reply(200, {'results': service.analyze_positions(body.get('positions'), body.get('depth'),
+                                                                      body.get('movetime'))})
+            elif path == '/stats' and method == 'GET':
+                self.reply(200, service.stats())
+            elif match and match.group(2) is None and method == 'GET':
+                self.reply(200, service.state(match.group(1)))
+            elif match and match.group(2) is None and method == 'DELETE':
+                service.delete_session(match.group(1))
+                self.reply(200, {'deleted': match.group(1)})
+            elif match and match.group(2) == 'move' and method == 'POST':
+                self.reply(200, service.make_move(match.group(1), body.get('move')))
+            elif match and match.group(2) == 'undo' and method == 'POST':
+                self.reply(200, service.undo_move(match.group(1)))
+            elif match and match.group(2) == 'analyze' and method == 'POST':
+                self.reply(200, service.analyze_session(match.group(1), body.get('depth'), body.get('movetime')))
+            else:
+                raise ServerError(404, "unknown endpoint: %s %s" % (method, path))
+        except ServerError as error:
+            self.reply(error.status, {'error': str(error)})
+        except Exception as error: #a bug, not the client's fault; the connection still gets a JSON answer
+            self.reply(500, {'error': "internal error: %s" % type(error).__name__})
+
+    def read_body(self):
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0 or length > MAX_BODY:
+            self.close_connection = True #the body isn't read, so the stream can't be used for another request
+            if length < 0:
+                raise ServerError(400, "invalid Content-Length")
+            raise ServerError(413, "request body too large")
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except ValueError:
+            raise ServerError(400, "body is not valid JSON")
+        if not isinstance(body, dict):
+            raise ServerError(400, "body must be a JSON object")
+        return body
+
+    def reply(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def make_server(service, host='127.0.0.1', port=DEFAULT_PORT):
+    handler = type('Handler', (RequestHandler,), {'service': service})
+    server_class = type('Server', (ThreadingHTTPServer,), {'request_queue_size': LISTEN_BACKLOG,
+                                                           'daemon_threads': True})
+    return server_class((host, port), handler)
+
+
+#JSON request to the server, returns (status, payload). Raises OSError if the server can't be reached.
+def request(url, method='GET', body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, method=method, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=60) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as error:
+        return error.code, json.loads(error.read() or b'{}')
+
+
+#Load generator: `clients` threads, each playing random legal moves in its own session (with the odd undo
+#and shallow analysis) for `requests` requests. Returns a summary dict with latency percentiles.
+def load_test(url, clients=20, requests=40, analyze_every=10, depth=1, seed=0):
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def timed(method, path, body=None):
+        start = time.perf_counter()
+        try:
+            status, payload = request(url + path, method, body)
+        except OSError: #refused or reset connections count as errors too
+            status, payload = 0, {}
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if status >= 400 or status == 0:
+                errors.append(status)
+        return status, payload
+
+    def client(number):
+        rng = random.Random(seed + number)
+        status, state = timed('POST', '/session', {})
+        if status != 201:
+            return
+        key = state['id']
+        for i in range(requests - 2):
+            if analyze_every and i % analyze_every == analyze_every - 1:
+                timed('POST', '/session/%s/analyze' % key, {'depth': depth})
+            elif state['moves'] and (not state['plies'] or rng.random() > 0.1):
+                status, reply = timed('POST', '/session/%s/move' % key, {'move': rng.choice(state['moves'])})
+                state = reply if status == 200 else state
+            elif state['plies']:
+                status, reply = timed('POST', '/session/%s/undo' % key)
+                state = reply if status == 200 else state
+            else:
+                break
+        timed('DELETE', '/session/%s' % key)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(int(p * len(latencies)), len(latencies) - 1)] * 1000 if latencies else 0.0
+
+    return {'requests': len(latencies), 'errors': len(errors), 'seconds': seconds,
+            'requests_per_second': len(latencies) / seconds if seconds else 0.0,
+            'p50_ms': percentile(0.50), 'p95_ms': percentile(0.95), 'p99_ms': percentile(0.99)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve multi-session analysis over HTTP, or load test a server.")
+    parser.add_argument("command", choices=('serve', 'load'))
+    parser.add_argument("--host", default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="search processes")
+    parser.add_argument("--hash", type=int, default=16, help="hash table per worker in MB (default 16)")
+    parser.add_argument("--max-sessions", type=int, default=1000)
+    parser.add_argument("--max-plies", type=int, default=1000, help="moves a session may hold (default 1000)")
+    parser.add_argument("--idle-timeout", type=float, default=600, help="seconds before an idle session is dropped")
+    parser.add_argument("--max-movetime", type=int, default=5000, help="longest search in milliseconds")
+    parser.add_argument("--max-depth", type=int, default=8)
+    parser.add_argument("--url", default="http://127.0.0.1:%d" % DEFAULT_PORT, help="server to load test")
+    parser.add_argument("--clients", type=int, default=20, help="concurrent load test clients")
+    parser.add_argument("--requests", type=int, default=40, help="requests per load test client")
+    args = parser.parse_args(argv)
+
+    if args.command == 'load':
+        summary = load_test(args.url.rstrip('/'), args.clients, args.requests)
+        print("%d requests, %d errors in %.1fs (%.0f requests/s); latency p50 %.1fms p95 %.1fms p99 %.1fms" % (
+            summary['requests'], summary['errors'], summary['seconds'], summary['requests_per_second'],
+            summary['p50_ms'], summary['p95_ms'], summary['p99_ms']))
+        return 1 if summary['errors'] else 0
+
+    service = AnalysisService(args.workers, args.hash, args.max_sessions, args.max_plies, args.idle_timeout,
+                              args.max_movetime / 1000, args.max_depth)
+    server = make_server(service, args.host, args.port)
+    print("serving on http://%s:%d with %d workers" % (args.host, args.port, service.workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,240 @@
+# Headless UCI (Universal Chess Interface) front end.
+# Reads commands from stdin on an asyncio loop and runs each search on a worker thread, so "stop", "isready"
+# and "quit" are answered while a search is going. Point a tournament manager (cutechess-cli, Arena, ...) at
+# "python uci.py".
+# Supported: uci, isready, ucinewgame, setoption name Hash|BookFile|BitbaseDir value <mb|path|dir>, position startpos|fen <fen> [moves ...],
+# go [depth n] [movetime ms] [nodes n] [wtime ms btime ms winc ms binc ms movestogo n] [infinite], stop, quit
+import asyncio
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import Engine
+import bitbases
+import perft
+import polyglot
+import search
+
+ENGINE_NAME = "Sahil's Chess Engine"
+ENGINE_AUTHOR = "Sahil"
+DEFAULT_HASH_MB = 16
+
+
+#Seconds to spend on a move from the clock: an even share of the remaining time (30 moves if the GUI didn't
+#say how many are left) plus most of the increment, keeping a safety margin for I/O
+def time_budget(remaining_ms, increment_ms=0, moves_to_go=None):
+    budget = remaining_ms / (moves_to_go or 30) + increment_ms * 0.8
+    budget = min(budget, remaining_ms - 50)
+    return max(budget, 10) / 1000
+
+
+#Parses the arguments of a "position" command into a GameState. Raises ValueError on a bad FEN or move.
+def parse_position(tokens):
+    if 'moves' in tokens:
+        split = tokens.index('moves')
+        setup, moves = tokens[:split], tokens[split + 1:]
+    else:
+        setup, moves = tokens, []
+    if setup[:1] == ['startpos']:
+        gs = Engine.GameState()
+    elif setup[:1] == ['fen']:
+        gs = Engine.GameState.from_fen(' '.join(setup[1:]))
+    else:
+        raise ValueError("expected startpos or fen: %s" % ' '.join(tokens))
+    for name in moves:
+        match = [move for move in perft.legal_moves(gs) if perft.move_name(move) == name]
+        if not match:
+            raise ValueError("illegal move: %s" % name)
+        gs.make_move(match[0])
+    return gs
+
+
+#Parses the arguments of a "go" command into a dict of search limits (depth, movetime in seconds, nodes)
+#plus 'infinite'
+def parse_go(tokens, white_to_move):
+    values = {}
+    infinite = False
+    i = 0
+    while i < len(tokens):
+        if tokens[i] in ('infinite', 'ponder'):
+            infinite = True
+            i += 1
+        elif i + 1 < len(tokens) and tokens[i + 1].lstrip('-').isdigit():
+            values[tokens[i]] = int(tokens[i + 1])
+            i += 2
+        else:
+            i += 1
+    limits = {'depth': values.get('depth'), 'nodes': values.get('nodes'), 'movetime': None, 'infinite': infinite}
+    if 'movetime' in values:
+        limits['movetime'] = values['movetime'] / 1000
+    elif not infinite:
+        clock, increment = ('wtime', 'winc') if white_to_move else ('btime', 'binc')
+        if clock in values:
+            limits['movetime'] = time_budget(values[clock], values.get(increment, 0), values.get('movestogo'))
+    return limits
+
+
+class UCIEngine():
+    #output is any callable taking one line of text
+    def __init__(self, output=None):
+        self.output = output or self.write_stdout
+        self.hash_mb = DEFAULT_HASH_MB
+        self.book = None #polyglot.OpeningBook, consulted before searching
+        self.bitbases = None #bitbases.Bitbases, handed to the search
+        self.searcher = search.Search(self.hash_mb)
+        self.gs = Engine.GameState()
+        self.executor = ThreadPoolExecutor(1) #searches run here, one at a time
+        self.search_task = None
+        self.stop_requested = None
+
+    @staticmethod
+    def write_stdout(line):
+        sys.stdout.write(line + '\n')
+        sys.stdout.flush()
+
+    #Reads stdin until "quit" or end of input. The blocking reads happen on a daemon thread that feeds a
+    #queue, so the loop stays free and a pending read doesn't keep the process alive after "quit".
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        lines = asyncio.Queue()
+
+        def read_stdin():
+            for line in sys.stdin:
+                loop.call_soon_threadsafe(lines.put_nowait, line)
+            loop.call_soon_threadsafe(lines.put_nowait, None)
+
+        threading.Thread(target=read_stdin, daemon=True).start()
+        try:
+            while True:
+                line = await lines.get()
+                if line is None or not await self.handle(line):
+                    break
+        finally:
+            await self.stop_search()
+            self.executor.shutdown()
+            if self.book is not None:
+                self.book.close()
+            if self.bitbases is not None:
+                self.bitbases.close()
+
+    #Handles one command line. Returns False once the engine should exit.
+    async def handle(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+        if command == 'uci':
+            self.output("id name %s" % ENGINE_NAME)
+            self.output("id author %s" % ENGINE_AUTHOR)
+            self.output("option name Hash type spin default %d min 1 max 4096" % DEFAULT_HASH_MB)
+            self.output("option name BookFile type string default <empty>")
+            self.output("option name BitbaseDir type string default <empty>")
+            self.output("uciok")
+        elif command == 'isready':
+            self.output("readyok")
+        elif command == 'ucinewgame':
+            await self.stop_search()
+            self.searcher.tt.clear()
+            self.gs = Engine.GameState()
+        elif command == 'setoption':
+            await self.set_option(args)
+        elif command == 'position':
+            await self.stop_search()
+            try:
+                self.gs = parse_position(args)
+            except ValueError as error:
+                self.output("info string %s" % error)
+        elif command == 'go':
+            await self.stop_search()
+            book_move = self.book.choose_move(self.gs) if self.book is not None else None
+            if book_move is not None:
+                self.output("info string book move")
+                self.output("bestmove %s" % perft.move_name(book_move))
+            else:
+                self.start_search(parse_go(args, self.gs.white_to_move))
+        elif command == 'stop':
+            await self.stop_search()
+        elif command == 'quit':
+            return False
+        else:
+            self.output("info string unknown command: %s" % command)
+        return True
+
+    async def set_option(self, args):
+        text = ' '.join(args)
+        if 'value' not in args or not text.startswith('name '):
+            return
+        name = text[len('name '):text.index(' value')].strip().lower()
+        value = text[text.index(' value') + len(' value'):].strip()
+        if name == 'hash' and value.isdigit():
+            await self.stop_search()
+            self.hash_mb = max(1, int(value))
+            self.searcher = search.Search(self.hash_mb, bitbases=self.bitbases)
+        elif name == 'bitbasedir':
+            await self.stop_search()
+            if self.bitbases is not None:
+                self.bitbases.close()
+                self.bitbases = None
+            if value and value != '<empty>':
+                try:
+                    self.bitbases = bitbases.Bitbases(value)
+                except (OSError, ValueError) as error:
+                    self.output("info string can't open bitbases: %s" % error)
+            self.searcher.bitbases = self.bitbases
+        elif name == 'bookfile':
+            if self.book is not None:
+                self.book.close()
+                self.book = None
+            if value and value != '<empty>':
+                try:
+                    self.book = polyglot.OpeningBook(value)
+                except OSError as error:
+                    self.output("info string can't open book: %s" % error)
+        else:
+            self.output("info string unknown option: %s" % name)
+
+    #Starts a search of the current position on the worker thread; "bestmove" is sent when it ends
+    def start_search(self, limits):
+        loop = asyncio.get_running_loop()
+        self.stop_requested = asyncio.Event()
+        gs, searcher, stop_requested = self.gs, self.searcher, self.stop_requested
+
+        started = time.perf_counter()
+
+        def info(iteration):
+            elapsed = max(time.perf_counter() - started, 1e-6)
+            line = "info depth %d score %s nodes %d nps %d time %d hashfull %d pv %s" % (
+                iteration['depth'], search.format_score(iteration['score']), searcher.nodes,
+                int(searcher.nodes / elapsed), int(elapsed * 1000), searcher.tt.hashfull(),
+                ' '.join(perft.move_name(move) for move in iteration['pv']))
+            loop.call_soon_threadsafe(self.output, line)
+
+        async def run_search():
+            result = await loop.run_in_executor(self.executor, lambda: searcher.search(
+                gs, depth=limits['depth'], movetime=limits['movetime'], nodes=limits['nodes'], info=info))
+            if limits['infinite']: #bestmove only after "stop", even if the search finished on its own
+                await stop_requested.wait()
+            self.output("bestmove %s" % (perft.move_name(result.best_move) if result.best_move else '0000'))
+
+        self.search_task = loop.create_task(run_search())
+
+    #Stops the running search, if any, and waits for its bestmove to be sent
+    async def stop_search(self):
+        if self.search_task is None:
+            return
+        self.stop_requested.set()
+        #keep signalling until it is done, a stop sent before the thread got to Search.search would be lost
+        while not self.search_task.done():
+            self.searcher.stop()
+            await asyncio.wait({self.search_task}, timeout=0.05)
+        self.search_task = None
+
+
+def main():
+    asyncio.run(UCIEngine().run())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())